@@ -4,7 +4,7 @@ import signal
 import sys
 from pathlib import Path
 
-from rich.logging import RichHandler
+from .events import changes
 
 PROJECT_URL = "https://github.com/f0e/discord-music-rpc"
 APP_NAME = "discord-music-rpc"
@@ -28,14 +28,22 @@ def get_config_dir():
 
 FORMAT = "%(message)s"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format=FORMAT,
-    datefmt="[%X]",
-    handlers=[
-        RichHandler(rich_tracebacks=True),
-    ],
-)
+
+def setup_logging():
+    """
+    Called by the entry point rather than on import, rich takes a while to load.
+    """
+    from rich.logging import RichHandler
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=FORMAT,
+        datefmt="[%X]",
+        handlers=[
+            RichHandler(rich_tracebacks=True),
+        ],
+    )
+
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +59,7 @@ class GracefulKiller:
     def exit_gracefully(self, signum=None, frame=None):
         logger.info(f"Received exit signal {signum}. Shutting down...")
         self.kill_now = True
+        changes.notify()  # wake the main loop so it notices
 
 
 killer = GracefulKiller()
@@ -1,88 +1,352 @@
+import asyncio
+import hmac
 import json
 import logging
+import time
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
 
-from pydantic import TypeAdapter
-from websockets import ConnectionClosedOK
-from websockets.sync.server import ServerConnection, serve
+from pydantic import TypeAdapter, ValidationError
+from websockets.asyncio.server import ServerConnection, broadcast, serve
+from websockets.http11 import Request, Response
 
-from .sources import TrackWithSource
+from .config import Config
+from .metrics import api_clients, api_messages
+from .sources import SourceKey, Track, TrackWithSource
+from .sources.registry import API_SOURCES, SOURCES_BY_NAME
+from .tracks import track_registry
+
+loads: Callable[[str | bytes], Any]
+
+try:
+    import orjson
+
+    loads = orjson.loads  # its errors subclass json.JSONDecodeError
+except ImportError:
+    loads = json.loads
 
 logger = logging.getLogger(__name__)
 
+# building one of these is slow, only do it once
+TRACK_ADAPTER = TypeAdapter(Track)
+
+# clients at this version or later get told the config, and only send tracks when
+# something changes plus a heartbeat
+PROTOCOL_VERSION = 2
+
+PING_INTERVAL_SEC = 20
+PING_TIMEOUT_SEC = 20
+MAX_QUEUE = 16  # incoming messages buffered per connection
+
+MESSAGE_TYPES = ("track_update", "track_batch")
+
+# allowed in without a token
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
 
-class Api:
-    current_tracks: dict[ServerConnection, TrackWithSource] = {}
 
-    def __init__(self, tracker, host="localhost", port=47474):
+@dataclass
+class Client:
+    conn: ServerConnection
+    previous_message: str | bytes | None = None
+    previous_config: Config | None = None
+    track_ttl_sec: float | None = None  # of its last track_update
+    sequences: dict[SourceKey, int] = field(default_factory=dict)  # last seen
+    producers: set[Hashable] = field(default_factory=set)  # what it put in the registry
+
+
+def is_local(address) -> bool:
+    return bool(address) and address[0] in LOCAL_ADDRESSES
+
+
+class Api:
+    def __init__(self, tracker):
         self.tracker = tracker
-        self.host = host
-        self.port = port
-        self.clients = set()
-        self.current_tracks = {}
+        self.clients: set[ServerConnection] = set()  # only touched from the loop
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.config_changed: asyncio.Event | None = None
+
+    async def handle_client(self, conn: ServerConnection):
+        client = Client(conn)
 
-    def handle_client(self, conn: ServerConnection) -> None:
         self.clients.add(conn)
+        api_clients.set(len(self.clients))
         logger.info(f"Client connected. Total clients: {len(self.clients)}")
 
+        await self.send_config(conn)
+
         try:
-            while True:
-                message = conn.recv()
-
-                try:
-                    track_json = json.loads(message)
-                    logger.debug(track_json)
-
-                    config = self.tracker.config
-
-                    match track_json["type"]:
-                        case "track_update":
-                            track_data = track_json["data"]
-                            source = track_json["source"]
-                            source_image = track_json["source_image"]
-
-                            source_config = config.for_source(
-                                source
-                            )  # todo: send config on connection and config change to clients so they dont send the data in the first place. doesnt really matter but would be nice
-
-                            if (
-                                not track_data
-                                or not source_config
-                                or not source_config.enabled
-                            ):
-                                self.current_tracks.pop(conn, None)
-                            else:
-                                validated_track = TypeAdapter(
-                                    TrackWithSource
-                                ).validate_python(
-                                    {
-                                        "track": track_data,
-                                        "source": source,
-                                        "source_image": source_image,
-                                    }
-                                )
-                                self.current_tracks[conn] = validated_track
-
-                            logger.debug(f"Current tracks: {self.current_tracks}")
-
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON received: {message}")
-        except ConnectionClosedOK:
-            pass
+            async for message in conn:
+                config = self.tracker.config
+                if not config:
+                    api_messages.inc(outcome="no_config")
+                    continue  # clients resend once they're sent the config
+
+                # every open tab sends an update every second, mostly the same
+                # one - nothing to do if neither it nor the config changed
+                if (
+                    message == client.previous_message
+                    and config is client.previous_config
+                ):
+                    api_messages.inc(outcome="duplicate")
+
+                    # heartbeats are often identical too, they still have to
+                    # keep the track from expiring
+                    if client.track_ttl_sec is not None:
+                        track_registry.touch(conn, client.track_ttl_sec)
+                    continue
+
+                client.previous_message = message
+                client.previous_config = config
+
+                self.handle_message(client, message, config)
         except Exception as e:
             logger.error(f"Client connection error: {e}")
         finally:
-            self.current_tracks.pop(conn, None)
+            track_registry.put(conn, None)
+            for producer in client.producers:
+                track_registry.put(producer, None)
+
             self.clients.remove(conn)
-            conn.close()
+            api_clients.set(len(self.clients))
             logger.info(f"Client disconnected. Total clients: {len(self.clients)}")
 
+    def handle_message(self, client: Client, message: str | bytes, config: Config):
+        try:
+            track_json = loads(message)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(track_json)
+
+            message_type = track_json["type"]
+
+            # labels stay around forever, don't let clients make up new ones
+            api_messages.inc(
+                outcome=message_type if message_type in MESSAGE_TYPES else "unknown"
+            )
+
+            match message_type:
+                case "track_update":
+                    client.track_ttl_sec = self.get_track_ttl(track_json, config)
+                    self.handle_track(
+                        client.conn,
+                        track_json["data"],
+                        track_json["source"],
+                        track_json["source_image"],
+                        None,
+                        client.track_ttl_sec,
+                        config,
+                    )
+
+                case "track_batch":
+                    self.handle_batch(client, track_json["updates"], config)
+
+        except json.JSONDecodeError:
+            api_messages.inc(outcome="invalid")
+            logger.error(f"Invalid JSON received: {message!r:.200}")
+        except (KeyError, TypeError, ValidationError) as e:
+            api_messages.inc(outcome="invalid")
+            logger.error(f"Invalid message received: {e}")
+
+    def handle_batch(self, client: Client, updates: list[dict], config: Config):
+        """
+        Several updates from a reporter in one frame, each with a sequence number
+        per (source, account) so stale and repeated ones can be skipped without
+        looking at the track.
+        """
+        for update in updates:
+            source = update["source"]
+            info = SOURCES_BY_NAME.get(source)
+            if not info:
+                api_messages.inc(outcome="invalid")
+                continue
+
+            # sequences are per account as the reporter knows it, whatever it
+            # ends up shown as
+            reported_key = (source, update.get("account"))
+
+            seq = update["seq"]
+            if seq <= client.sequences.get(reported_key, -1):
+                api_messages.inc(outcome="out_of_sequence")
+                continue
+
+            client.sequences[reported_key] = seq
+
+            producer = (client.conn, reported_key)
+            client.producers.add(producer)
+
+            # each account gets a discord connection of its own, so only ones in
+            # the config get one and anything else shows as the source itself
+            account = reported_key[1]
+            if account is not None and account not in {
+                account_config.name for account_config in info.get_accounts(config)
+            }:
+                logger.debug(
+                    f"Unknown {source} account {account!r}, showing as {source}"
+                )
+                account = None
+
+            self.handle_track(
+                producer,
+                update["data"],
+                source,
+                update["source_image"],
+                account,
+                config.api.heartbeat_sec * 3,
+                config,
+            )
+
+    def handle_track(
+        self,
+        producer: Hashable,
+        track_data: dict | None,
+        source: str,
+        source_image: str,
+        account: str | None,
+        ttl_sec: float | None,
+        config: Config,
+    ):
+        # older clients don't know about the config and send everything, newer
+        # ones shouldn't send these
+        info = SOURCES_BY_NAME.get(source)
+
+        if not track_data or not info or not info.get_config(config).enabled:
+            track_registry.put(producer, None)
+            return
+
+        track = TRACK_ADAPTER.validate_python(track_data)
+        track.progress_time = time.time()
+        track_registry.put(
+            producer, TrackWithSource(track, source, source_image, account), ttl_sec
+        )
+
+    @staticmethod
+    def get_track_ttl(track_json: dict, config: Config) -> float | None:
+        # newer clients heartbeat, so we can tell if they've gone quiet
+        if track_json.get("version", 1) >= PROTOCOL_VERSION:
+            return config.api.heartbeat_sec * 3
+
+        return None
+
+    def get_config_message(self, config: Config) -> str:
+        return json.dumps(
+            {
+                "version": PROTOCOL_VERSION,
+                "type": "config",
+                "sources": {
+                    info.name: info.get_config(config).enabled for info in API_SOURCES
+                },
+                "min_update_gap_sec": config.api.min_update_gap_sec,
+                "heartbeat_sec": config.api.heartbeat_sec,
+            }
+        )
+
+    async def send_config(self, conn: ServerConnection):
+        config = self.tracker.config
+        if not config:
+            return  # sent once it's loaded
+
+        try:
+            await conn.send(self.get_config_message(config))
+        except Exception as e:
+            logger.debug(f"Failed to send config to client: {e}")
+
+    def broadcast_config(self):
+        """
+        Tell the server the config changed, it restarts if it has to listen
+        somewhere else and otherwise tells every client. Safe to call from any
+        thread.
+        """
+        if self.loop and self.config_changed:
+            self.loop.call_soon_threadsafe(self.config_changed.set)
+
+    def send_config_to_all(self):
+        config = self.tracker.config
+        if not config or not self.clients:
+            return
+
+        # doesn't wait on slow clients, they just miss out
+        broadcast(self.clients, self.get_config_message(config))
+
+    def check_token(self, conn: ServerConnection, request: Request) -> Response | None:
+        config = self.tracker.config
+        token = config and config.api.token
+
+        if not token or is_local(conn.remote_address):
+            return None
+
+        # browsers can't set headers on websockets, so allow it in the url too
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not supplied:
+            supplied = parse_qs(urlsplit(request.path).query).get("token", [""])[0]
+
+        if hmac.compare_digest(supplied.encode(), token.encode()):
+            return None
+
+        logger.warning(f"Rejected client {conn.remote_address[0]} with a bad token")
+        return conn.respond(HTTPStatus.UNAUTHORIZED, "Invalid token\n")
+
     def start(self):
         try:
-            with serve(self.handle_client, self.host, self.port) as server:
-                logger.info(f"WebSocket server started on {self.host}:{self.port}")
-                server.serve_forever()
+            asyncio.run(self.serve())
         except Exception as e:
-            logger.error(f"Server start error: {e}")
+            logger.error(f"Server error: {e}")
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.config_changed = asyncio.Event()
+
+        while True:
+            config = self.tracker.config
+            if not config:
+                await self.wait_for_config_change()
+                continue
+
+            settings = (config.api.host, config.api.port, config.api.token)
+
+            if config.api.host not in ("localhost", *LOCAL_ADDRESSES) and not (
+                config.api.token
+            ):
+                logger.warning(
+                    "API is listening beyond localhost without a token, anyone "
+                    "who can reach it can set tracks"
+                )
+
+            try:
+                async with serve(
+                    self.handle_client,
+                    config.api.host,
+                    config.api.port,
+                    process_request=self.check_token,
+                    # clients that stop answering pings (sleeping laptops, killed
+                    # tabs) get dropped along with their tracks
+                    ping_interval=PING_INTERVAL_SEC,
+                    ping_timeout=PING_TIMEOUT_SEC,
+                    # stop reading from clients that send faster than we handle
+                    # them
+                    max_queue=MAX_QUEUE,
+                ):
+                    logger.info(
+                        f"WebSocket server started on {config.api.host}:{config.api.port}"
+                    )
+
+                    while settings == (
+                        config.api.host,
+                        config.api.port,
+                        config.api.token,
+                    ):
+                        self.send_config_to_all()
+                        await self.wait_for_config_change()
+                        config = self.tracker.config
+
+                    logger.info("API settings changed, restarting the server")
+            except OSError as e:
+                logger.error(f"Server start error: {e}")
+                await self.wait_for_config_change()
 
-    def get_current_tracks(self) -> list[TrackWithSource]:
-        return list(self.current_tracks.values())
+    async def wait_for_config_change(self):
+        assert self.config_changed
+        await self.config_changed.wait()
+        self.config_changed.clear()
@@ -1,10 +1,15 @@
+import hashlib
 import logging
+import threading
 from pathlib import Path
 
 import yaml
 from pydantic import BaseModel
 
 from . import CONFIG_DIR, utils
+from .events import changes
+from .metrics import config_reload_seconds
+from .watcher import FileWatcher
 
 logger = logging.getLogger(__name__)
 
@@ -17,116 +22,249 @@ class DiscordConfig(BaseModel):
     show_source_logo: bool = True
     show_urls: bool = True
     show_ad: bool = True
+    hide_duplicates: bool = True  # only show a song once if several sources play it
+    idle_disconnect_sec: float = 60.0
 
 
-class SpotifyConfig(BaseModel):
+class HttpConfig(BaseModel):
+    timeout_sec: float = 10.0
+    retries: int = 3
+    retry_backoff_sec: float = 0.5
+    retry_jitter_sec: float = 0.5
+    max_connections_per_host: int = 4
+
+
+class ApiConfig(BaseModel):
+    host: str = "localhost"  # 0.0.0.0 to accept reporters from other machines
+    port: int = 47474
+    token: str | None = None  # required from anything that isn't localhost
+    min_update_gap_sec: float = 1.0  # how often clients should check for changes
+    heartbeat_sec: float = 30.0  # and resend even if nothing changed
+
+
+class MetricsConfig(BaseModel):
+    enabled: bool = False  # serve prometheus metrics on /metrics
+    host: str = "localhost"
+    port: int = 47475
+
+
+# every source's block has at least this
+class SourceConfig(BaseModel):
     enabled: bool = False
+
+
+class AccountConfig(SourceConfig):
+    enabled: bool = True
+    name: str | None = None  # tells accounts of the same service apart
+    discord_pipe: int | None = None  # which discord client (0-9) to show it on
+    discord_client_id: str | None = None  # show as your own discord application
+
+    def is_configured(self) -> bool:
+        return True
+
+    def get_accounts(self) -> list["AccountConfig"]:
+        """
+        Enabled accounts listed under this block, plus the block itself if it has
+        credentials of its own (or nothing else is listed).
+        """
+        if not self.enabled:
+            return []
+
+        accounts = [
+            account for account in getattr(self, "accounts", []) if account.enabled
+        ]
+
+        if self.is_configured() or not accounts:
+            accounts.insert(0, self)
+
+        return accounts
+
+
+class SpotifyAccountConfig(AccountConfig):
     client_id: str | None = None
     client_secret: str | None = None
     redirect_uri: str = "http://localhost:8888/callback"
+    # progress is extrapolated between polls, they're only needed to catch skips,
+    # pauses and seeks, so this is also how long those can take to show up
+    max_update_gap: float = 3.0
 
+    def is_configured(self) -> bool:
+        return bool(self.client_id and self.client_secret)
 
-class LastFmConfig(BaseModel):
+
+class SpotifyConfig(SpotifyAccountConfig):
     enabled: bool = False
+    accounts: list[SpotifyAccountConfig] = []
+
+
+class LastFmAccountConfig(AccountConfig):
     username: str | None = None
     api_key: str | None = None
-    # todo: skip if already showing in rpc? tricky though because titles might be slightly different
+    # polls slow down to this while idle or mid-track, so it's also how long a
+    # skip can take to show up
+    max_update_gap: float = 3.0
+
+    def is_configured(self) -> bool:
+        return bool(self.username and self.api_key)
 
 
-class PlexConfig(BaseModel):
+class LastFmConfig(LastFmAccountConfig):
     enabled: bool = False
+    accounts: list[LastFmAccountConfig] = []
+
+
+class PlexAccountConfig(AccountConfig):
     server_url: str | None = None
     token: str | None = None
     libraries: list[str] = []
+    push: bool = True  # listen for the server's notifications instead of polling
+
+    def is_configured(self) -> bool:
+        return bool(self.server_url and self.token)
 
 
-class SoundCloudConfig(BaseModel):
+class PlexConfig(PlexAccountConfig):
     enabled: bool = False
+    accounts: list[PlexAccountConfig] = []
 
 
-class YouTubeConfig(BaseModel):
+class MprisConfig(AccountConfig):
     enabled: bool = False
+    players: list[str] = []  # only these, e.g. ["mpv", "vlc"]. empty for any
+    # browsers are better covered by the userscript
+    ignored_players: list[str] = ["firefox", "chromium", "chrome", "brave"]
+
+
+class SoundCloudConfig(SourceConfig):
+    pass
+
+
+class YouTubeConfig(SourceConfig):
+    pass
 
 
 class Config(BaseModel):
     discord: DiscordConfig = DiscordConfig()
+    http: HttpConfig = HttpConfig()
+    api: ApiConfig = ApiConfig()
+    metrics: MetricsConfig = MetricsConfig()
     spotify: SpotifyConfig = SpotifyConfig()
     lastfm: LastFmConfig = LastFmConfig()
     plex: PlexConfig = PlexConfig()
     soundcloud: SoundCloudConfig = SoundCloudConfig()
     youtube: YouTubeConfig = YouTubeConfig()
+    mpris: MprisConfig = MprisConfig()
 
     def validate(self):
-        # Spotify configuration checks
-        if not self.spotify.client_id:
-            logger.info(
-                "Note: spotify.client_id not configured. Spotify support will be disabled."
-            )
-        if not self.spotify.client_secret:
-            logger.info(
-                "Note: spotify.client_secret not configured. Spotify support will be disabled."
-            )
+        # credentials each account needs, checked per account so configs that only
+        # use `accounts` don't get told the block itself is missing them
+        required = (
+            ("spotify", "Spotify", self.spotify, ("client_id", "client_secret")),
+            ("lastfm", "Last.fm", self.lastfm, ("username", "api_key")),
+            ("plex", "Plex", self.plex, ("server_url", "token")),
+        )
 
-        # Last.fm configuration checks
-        if not self.lastfm.username:
-            logger.info(
-                "Note: lastfm.username not configured. Last.fm support will be disabled."
-            )
-        if not self.lastfm.api_key:
-            logger.info(
-                "Note: lastfm.api_key not configured. Last.fm support will be disabled."
-            )
+        for key, name, block, fields in required:
+            for account in block.get_accounts():
+                path, label = key, name
+                if account is not block:
+                    path = f"{key}.accounts[{account.name}]"
+                    label = f"{name} ({account.name})"
 
-        # Plex configuration checks
-        if not self.plex.server_url:
-            logger.info(
-                "Note: plex.server_url not configured. Plex support will be disabled."
-            )
-        if not self.plex.token:
+                for field in fields:
+                    if not getattr(account, field):
+                        logger.info(
+                            f"Note: {path}.{field} not configured. {label} support will be disabled."
+                        )
+
+        if self.mpris.enabled and not self.mpris.discord_client_id:
             logger.info(
-                "Note: plex.token not configured. Plex support will be disabled."
+                "Note: mpris.discord_client_id not configured. Local players won't be shown."
             )
 
         # todo return false if nothings enabled? idk
         return True
 
-    def for_source(self, source: str):
-        return getattr(
-            self,
-            source.lower().replace(".", ""),  # todo: hacky and gross but whatever
-            None,
-        )
-
     def dump(self):
         return self.model_dump()
 
+    def to_yaml(self) -> str:
+        return yaml.dump(self.dump(), Dumper=utils.PrettyDumper, sort_keys=False)
+
     def save(self, path: Path = CFG_PATH):
-        with path.open("w") as f:
-            yaml.dump(self.dump(), f, Dumper=utils.PrettyDumper, sort_keys=False)
+        path.write_text(self.to_yaml())
 
     @staticmethod
-    def load(path: Path = CFG_PATH):
-        if not path.exists() or path.stat().st_size == 0:
-            Config().save()
+    def from_yaml(text: str):
+        yaml_data = yaml.safe_load(text)
 
-        with path.open("r") as f:
-            yaml_data = yaml.safe_load(f)
+        if not isinstance(yaml_data, dict):
+            raise ValueError("YAML data is not a dictionary")
 
-            if not isinstance(yaml_data, dict):
-                raise ValueError("YAML data is not a dictionary")
+        return Config(**yaml_data)
 
-            return Config(**yaml_data)
 
+class ConfigWatcher:
+    """
+    Keeps the parsed config around and only re-reads the file once the watcher
+    says it changed, and only re-parses it if the content is actually different.
+    """
 
-def load_config():
-    config = Config.load()
+    def __init__(self, path: Path = CFG_PATH):
+        self.path = path
+        self.config: Config | None = None
+        self.digest: bytes | None = None
+        self.dirty = threading.Event()
+        self.dirty.set()
+        self.watcher = FileWatcher(path, self.on_change)
+
+    def on_change(self):
+        self.dirty.set()
+        changes.notify()
+
+    def load(self) -> Config:
+        self.watcher.start()
+
+        if self.config and not self.dirty.is_set():
+            return self.config
+
+        # clear before reading so a write that lands mid-read flags us again
+        self.dirty.clear()
+
+        raw = self.path.read_bytes() if self.path.exists() else b""
+        digest = hashlib.sha256(raw).digest()
+
+        if self.config and digest == self.digest:
+            return self.config
 
-    try:
-        # config might be missing or have extra variables, save after validating
-        # todo: i know if you just created a config for the first time this will save pointlessly but idc
-        config.save()
-    except:
-        logger.info("Failed to save config")
-        pass
+        try:
+            with config_reload_seconds.time():
+                config = Config.from_yaml(raw.decode()) if raw.strip() else Config()
+        except Exception:
+            if not self.config:
+                raise
 
-    return config
+            # keep running with what we had, don't retry until the file changes again
+            logger.exception("Failed to parse config, keeping the previous one")
+            self.digest = digest
+            return self.config
+
+        # config might be missing or have extra variables, save it back normalised
+        normalised = config.to_yaml().encode()
+        if normalised != raw:
+            try:
+                self.path.write_bytes(normalised)
+                digest = hashlib.sha256(normalised).digest()
+            except OSError:
+                logger.info("Failed to save config")
+
+        self.config = config
+        self.digest = digest
+        return config
+
+
+config_watcher = ConfigWatcher()
+
+
+def load_config():
+    return config_watcher.load()
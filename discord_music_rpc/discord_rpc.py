@@ -1,151 +1,353 @@
 import datetime
 import logging
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from typing import Any
 
-from pypresence import ActivityType, Presence, StatusDisplayType
+from pypresence import Presence, StatusDisplayType
+from pypresence.exceptions import PyPresenceException
 
 from . import APP_NAME, PROJECT_URL
 from .config import Config
-from .sources import TrackWithSource
-from .utils import is_same_track
+from .metrics import (
+    discord_errors,
+    discord_ipc_seconds,
+    discord_throttled,
+    discord_updates,
+)
+from .sources import SourceKey, TrackWithSource
+from .sources.registry import SOURCES_BY_NAME, SourceInfo
+from .tracks import arbitrate
+from .utils import RateLimiter
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_IMAGE = "https://upload.wikimedia.org/wikipedia/commons/thumb/0/02/CD_icon_test.svg/240px-CD_icon_test.svg.png"
 
-# todo: move this stuff out of here? into sources? idk for api tho
-client_ids = {
-    "YouTube": "1316777493889286206",
-    "Spotify": "1316777610419634180",
-    "SoundCloud": "1316777669945458789",
-    "Plex": "1316777729508642857",
-    "Last.fm": "1316777803768664076",
-}
 
-activity_type_overrides = {"YouTube": ActivityType.WATCHING}
+# discord only accepts ~5 activity updates per 20 seconds per client, and rejects
+# the rest. a bit of slack so ipc latency can't push one into the previous window
+UPDATE_LIMIT = 5
+UPDATE_LIMIT_PERIOD_SEC = 20
+UPDATE_LIMIT_SLACK_SEC = 0.5
+
+# start/end timestamps within this of what discord already has aren't worth an update
+PROGRESS_TOLERANCE_MS = 2000
+
+RECONNECT_MIN_SEC = 1
+RECONNECT_MAX_SEC = 60
+
+Activity = dict[str, Any]
 
 
 @dataclass
 class RpcWrapper:
-    presence: Presence
-    last_progress: float | None = None
-    last_track: TrackWithSource | None = None
+    key: SourceKey
+    info: SourceInfo
+    client_id: str
+    pipe: int | None = None  # which discord client to talk to, None for the first found
+    presence: Presence | None = None  # only connected while there's something to show
+    last_activity: Activity | None = None
+    pending: bool = False  # wanted to update but got throttled or couldn't connect
+    idle_since: float | None = None
+    retry_at: float = 0
+    retry_delay: float = RECONNECT_MIN_SEC
+    limiter: RateLimiter = field(
+        default_factory=lambda: RateLimiter(
+            UPDATE_LIMIT, UPDATE_LIMIT_PERIOD_SEC + UPDATE_LIMIT_SLACK_SEC
+        )
+    )
+
+    @property
+    def name(self) -> str:
+        source, account = self.key
+        return f"{source} ({account})" if account else source
+
+
+def is_same_activity(activity1: Activity | None, activity2: Activity | None) -> bool:
+    if activity1 is None or activity2 is None:
+        return activity1 is activity2
+
+    for key in activity1.keys() | activity2.keys():
+        value1, value2 = activity1.get(key), activity2.get(key)
+
+        if key in ("start", "end") and value1 and value2:
+            if abs(value1 - value2) > PROGRESS_TOLERANCE_MS:
+                return False
+        elif value1 != value2:
+            return False
+
+    return True
 
 
 class DiscordRichPresence:
     def __init__(self, config: Config):
         self.config = config
-        self.rpcs = {
-            key: RpcWrapper(Presence(client_id))
-            for key, client_id in client_ids.items()
+        # one per (source, account), created when it first has a track
+        self.rpcs: dict[SourceKey, RpcWrapper] = {}
+        self.tracks_version: int | None = None  # version of the tracks last synced
+
+    def get_rpc(self, key: SourceKey) -> RpcWrapper | None:
+        if key in self.rpcs:
+            return self.rpcs[key]
+
+        source, account = key
+        info = SOURCES_BY_NAME.get(source)
+        if not info:
+            return None
+
+        account_config = next(
+            (
+                account_config
+                for account_config in info.get_accounts(self.config)
+                if account_config.name == account
+            ),
+            None,
+        )
+
+        client_id = (
+            account_config and account_config.discord_client_id
+        ) or info.client_id
+        if not client_id:
+            logger.debug(f"No Discord client id for {source}, not showing it")
+            return None
+
+        rpc = RpcWrapper(
+            key,
+            info,
+            client_id,
+            account_config.discord_pipe if account_config else None,
+        )
+        self.rpcs[key] = rpc
+        return rpc
+
+    def ensure_connected(self, rpc: RpcWrapper) -> bool:
+        if rpc.presence:
+            return True
+
+        if time.monotonic() < rpc.retry_at:
+            return False
+
+        presence = Presence(rpc.client_id, pipe=rpc.pipe)
+
+        try:
+            with discord_ipc_seconds.time(op="connect"):
+                presence.connect()
+        except (PyPresenceException, OSError) as e:
+            discord_errors.inc(op="connect")
+            logger.warning(
+                f"Couldn't connect to Discord RPC for {rpc.name}, "
+                f"retrying in {rpc.retry_delay}s: {e}"
+            )
+            rpc.retry_at = time.monotonic() + rpc.retry_delay
+            rpc.retry_delay = min(rpc.retry_delay * 2, RECONNECT_MAX_SEC)
+            return False
+
+        logger.info(f"Connected to Discord RPC for {rpc.name}")
+
+        rpc.presence = presence
+        rpc.retry_delay = RECONNECT_MIN_SEC
+        return True
+
+    def disconnect(self, rpc: RpcWrapper):
+        if not rpc.presence:
+            return
+
+        try:
+            rpc.presence.close()
+        except Exception as e:
+            logger.debug(f"Error closing Discord RPC for {rpc.name}: {e}")
+
+        # discord drops the activity along with the pipe
+        rpc.presence = None
+        rpc.last_activity = None
+        rpc.idle_since = None
+
+    def update(self, tracks: dict[SourceKey, TrackWithSource], version: int):
+        # same tracks as last time, only retries and idle timeouts can need doing
+        if version == self.tracks_version and not any(
+            rpc.pending or (rpc.presence and rpc.idle_since is not None)
+            for rpc in self.rpcs.values()
+        ):
+            return
+
+        self.tracks_version = version
+
+        if self.config.discord.hide_duplicates:
+            # presences for the duplicates just go idle
+            tracks = arbitrate(tracks)
+
+        for key in tracks:
+            self.get_rpc(key)
+
+        for key, rpc in list(self.rpcs.items()):
+            track = tracks.get(key)
+
+            activity = None
+
+            if track and rpc.info.get_config(self.config).enabled:
+                activity = self.build_activity(rpc.info, track)
+
+            self.sync(rpc, activity)
+
+            # accounts come and go, don't hang on to ones with nothing left to do
+            if not track and not rpc.presence and not rpc.pending:
+                del self.rpcs[key]
+
+    def build_activity(self, info: SourceInfo, track: TrackWithSource) -> Activity:
+        buttons = []
+
+        start_time_ms = None
+        end_time_ms = None
+
+        if self.config.discord.show_urls and track.track.url:
+            buttons.append(
+                {
+                    "label": f"View track on {track.source}",
+                    "url": track.track.url or "",
+                }
+            )
+
+        if self.config.discord.show_ad:
+            buttons.append(
+                {
+                    "label": f"Powered by {APP_NAME}",
+                    "url": PROJECT_URL,
+                }
+            )
+
+        # handle progress - anchored to when it was sampled, so the same progress
+        # always gives the same start time and discord handles the rest
+        if track.track.progress_ms is not None and track.track.duration_ms is not None:
+            progress_time = track.track.progress_time or time.time()
+            start_time_ms = int(progress_time * 1000 - track.track.progress_ms)
+            end_time_ms = start_time_ms + int(track.track.duration_ms)
+
+        status_type = StatusDisplayType.NAME
+        match self.config.discord.status_type:
+            case "artist":
+                status_type = StatusDisplayType.STATE
+
+            case "song":
+                status_type = StatusDisplayType.DETAILS
+
+        return {
+            "activity_type": info.activity_type,
+            "status_display_type": status_type,
+            "buttons": buttons,
+            "details": track.track.name.ljust(
+                2
+            )  # "details" length must be at least 2 characters long
+            if track.track.name
+            else None,
+            "state": track.track.artist,
+            "large_image": track.track.image or DEFAULT_IMAGE,
+            "large_text": track.track.album.ljust(
+                2
+            )  # "large_text" length must be at least 2 characters long
+            if track.track.album
+            else None,
+            "start": start_time_ms
+            if start_time_ms and self.config.discord.show_progress
+            else None,
+            "end": end_time_ms
+            if end_time_ms and self.config.discord.show_progress
+            else None,
+            "small_image": track.source_image
+            if self.config.discord.show_source_logo
+            else None,
+            "small_text": f"Listening on {track.source}"
+            if self.config.discord.show_source_logo
+            else None,
         }
 
-    def connect(self):
-        for rpc in self.rpcs.values():
-            rpc.presence.connect()
+    def sync(self, rpc: RpcWrapper, activity: Activity | None):
+        if activity is None:
+            if not rpc.presence:
+                # nothing's showing without a connection anyway
+                rpc.last_activity = None
+                rpc.pending = False
+                return
 
-        logger.info("Connected to Discord RPC")
+            now = time.monotonic()
+            if rpc.idle_since is None:
+                rpc.idle_since = now
+            elif now - rpc.idle_since >= self.config.discord.idle_disconnect_sec:
+                logger.debug(f"Closing idle Discord RPC for {rpc.name}")
+                self.disconnect(rpc)
+                rpc.pending = False
+                return
+        else:
+            rpc.idle_since = None
 
-    def update(self, tracks: list[TrackWithSource]):
-        for source, rpc in self.rpcs.items():
-            source_config = self.config.for_source(source)
+        if is_same_activity(activity, rpc.last_activity):
+            rpc.pending = False
+            return
 
-            track = next(
-                (t for t in tracks if t.source == source), None
-            )  # todo: dont love this, maybe change input to a dict and stop using lists everywhere
+        # the main loop comes back once we're able to send again, and sends
+        # whatever the latest state is by then
+        rpc.pending = True
 
-            if not source_config.enabled or not track:
-                rpc.presence.clear()
-                rpc.last_track = None
-                rpc.last_progress = None
-                continue
+        if not self.ensure_connected(rpc):
+            return
 
-            buttons = []
+        if not rpc.limiter.try_acquire():
+            discord_throttled.inc(source=rpc.key[0])
+            return
 
-            start_time_ms = None
-            end_time_ms = None
+        assert rpc.presence
 
-            if self.config.discord.show_urls and track.track.url:
-                buttons.append(
-                    {
-                        "label": f"View track on {track.source}",
-                        "url": track.track.url or "",
-                    }
-                )
+        op = "clear" if activity is None else "update"
+
+        try:
+            with discord_ipc_seconds.time(op=op):
+                if activity is None:
+                    rpc.presence.clear()
+                else:
+                    rpc.presence.update(**activity)
+        except (PyPresenceException, OSError) as e:
+            discord_errors.inc(op=op)
+            logger.warning(f"Lost connection to Discord RPC for {rpc.name}: {e}")
+            self.disconnect(rpc)
+            rpc.retry_at = time.monotonic() + rpc.retry_delay
+            return
 
-            if self.config.discord.show_ad:
-                buttons.append(
-                    {
-                        "label": f"Powered by {APP_NAME}",
-                        "url": PROJECT_URL,
-                    }
+        discord_updates.inc(source=rpc.key[0], op=op)
+
+        rpc.last_activity = activity
+        rpc.pending = False
+
+    def get_next_deadline(self) -> datetime.datetime | None:
+        """
+        When the next throttled or failed update can be retried, or an idle
+        connection should be closed.
+        """
+        now = time.monotonic()
+        delays = []
+
+        for rpc in self.rpcs.values():
+            if rpc.pending:
+                delays.append(
+                    max(rpc.limiter.time_until_available(), rpc.retry_at - now)
+                )
+            elif rpc.presence and rpc.idle_since is not None:
+                delays.append(
+                    rpc.idle_since + self.config.discord.idle_disconnect_sec - now
                 )
 
-            # handle progress
-            if not is_same_track(track, rpc.last_track):
-                rpc.last_progress = None
-
-            if (
-                track.track.progress_ms is not None
-                and track.track.duration_ms is not None
-            ):
-                if (
-                    track.track.progress_ms == rpc.last_progress
-                ):  # haven't gotten any progress, don't update - discord will handle it
-                    continue
-
-                start_time_ms = (
-                    int(datetime.datetime.now().timestamp() * 1000)
-                ) - track.track.progress_ms
-                end_time_ms = start_time_ms + track.track.duration_ms
-                rpc.last_progress = track.track.progress_ms
-
-            status_type = StatusDisplayType.NAME
-            match self.config.discord.status_type:
-                case "artist":
-                    status_type = StatusDisplayType.STATE
-
-                case "song":
-                    status_type = StatusDisplayType.DETAILS
-
-            rpc.presence.update(
-                activity_type=ActivityType.LISTENING
-                if source not in activity_type_overrides
-                else activity_type_overrides[source],
-                status_display_type=status_type,
-                buttons=buttons,
-                details=track.track.name.ljust(
-                    2
-                )  # "details" length must be at least 2 characters long
-                if track.track.name
-                else None,
-                state=track.track.artist,
-                large_image=track.track.image or DEFAULT_IMAGE,
-                large_text=track.track.album.ljust(
-                    2
-                )  # "large_text" length must be at least 2 characters long
-                if track.track.album
-                else None,
-                start=start_time_ms
-                if start_time_ms and self.config.discord.show_progress
-                else None,
-                end=end_time_ms
-                if end_time_ms and self.config.discord.show_progress
-                else None,
-                small_image=track.source_image
-                if self.config.discord.show_source_logo
-                else None,
-                small_text=f"Listening on {track.source}"
-                if self.config.discord.show_source_logo
-                else None,
-            )
+        if not delays:
+            return None
 
-            rpc.last_track = track
+        return datetime.datetime.now() + datetime.timedelta(seconds=max(min(delays), 0))
 
     def close(self):
-        try:
-            for rpc in self.rpcs.values():
+        for rpc in self.rpcs.values():
+            if not rpc.presence:
+                continue
+
+            try:
                 rpc.presence.clear()
-                rpc.presence.close()
-        except Exception as e:
-            logger.error(e)
+            except Exception as e:
+                logger.error(e)
+
+            self.disconnect(rpc)
@@ -0,0 +1,29 @@
+import threading
+
+
+class ChangeNotifier:
+    """
+    Version counter that producers bump whenever something the main loop cares
+    about changes, so the loop can sleep until there's actually work to do.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version: int, timeout: float | None = None) -> int:
+        """
+        Block until the version moves past `version` or `timeout` seconds pass.
+        Returns the current version.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+changes = ChangeNotifier()
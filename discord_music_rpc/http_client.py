@@ -0,0 +1,82 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .config import HttpConfig
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session that applies a default timeout, requests has none.
+    """
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def create_session(config: HttpConfig) -> TimeoutSession:
+    session = TimeoutSession(config.timeout_sec)
+
+    retry = Retry(
+        total=config.retries,
+        backoff_factor=config.retry_backoff_sec,
+        backoff_jitter=config.retry_jitter_sec,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,  # let the caller's raise_for_status deal with it
+    )
+    adapter = HTTPAdapter(
+        pool_maxsize=config.max_connections_per_host,
+        # otherwise the pool size only caps how many are kept around, not how
+        # many get opened. requests past it wait for a connection to free up
+        pool_block=True,
+        max_retries=retry,
+    )
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+_lock = threading.Lock()
+_session: TimeoutSession | None = None
+_session_config: HttpConfig | None = None
+
+
+def configure(config: HttpConfig):
+    """
+    Swap the shared session out if the http config changed. The old session is
+    left for whoever's still using it to finish with.
+    """
+    global _session, _session_config
+
+    with _lock:
+        if _session and config == _session_config:
+            return
+
+        _session = create_session(config)
+        _session_config = config
+
+
+def get_session() -> TimeoutSession:
+    global _session, _session_config
+
+    with _lock:
+        if not _session:
+            _session_config = HttpConfig()
+            _session = create_session(_session_config)
+
+        return _session
@@ -1,29 +1,37 @@
+import argparse
+import datetime
 import logging
 import threading
 import time
 
-import pypresence
-
-from . import killer
+from . import killer, setup_logging
 from .api import Api
 from .config import load_config
 from .discord_rpc import DiscordRichPresence
+from .events import changes
+from .metrics import main_loop_ticks, metrics, metrics_server
 from .sources import MusicSourceManager
+from .tracks import track_registry
 from .tray import run_tray_icon
 
 logger = logging.getLogger(__name__)
 
 
 class MusicTracker:
-    MAIN_SLEEP_SEC = 1
+    MAX_WAIT_SEC = 60  # config changes wake us up anyway, this is just a safety net
+    STATS_GAP_SEC = 60
 
-    def __init__(self):
+    def __init__(self, stats=False):
         self.api = Api(self)
         self.icon = None
         self.discord_rpc = None
         self.music_sources = None
         self.config = None
 
+        # log a summary of the metrics every so often
+        self.stats = stats
+        self.next_stats_time = datetime.datetime.now()
+
     def run(self):
         # start api in a separate thread
         threading.Thread(target=self.api.start, daemon=True).start()
@@ -39,46 +47,38 @@ class MusicTracker:
 
                 self.music_sources = MusicSourceManager(self.config)
                 self.discord_rpc = DiscordRichPresence(self.config)
+                self.api.broadcast_config()
+                metrics_server.apply(self.config.metrics)
 
+                # discord connections are opened per source when they have something
+                # to show, and reconnect on their own
                 try:
-                    logger.debug("Connecting to RPC")
-                    self.discord_rpc.connect()
-                    logger.debug("Connected to RPC")
-
                     while not killer.kill_now:
                         _config, config_updated = get_config(self.config)
                         if config_updated:
                             logger.info("Config updated, reloading")
                             break
 
-                        current_tracks = [
-                            *self.api.get_current_tracks(),
-                            *self.music_sources.get_current_tracks(),
-                        ]
+                        # grab the version before reading tracks so changes made while
+                        # updating wake us straight back up
+                        version = changes.version
+                        main_loop_ticks.inc()
+
+                        track_registry.expire()
+                        tracks_version, tracks = track_registry.get_tracks()
 
-                        self.discord_rpc.update(
-                            [track for track in current_tracks if track]
-                        )
+                        self.discord_rpc.update(tracks, tracks_version)
 
                         # update_tray(self.icon, current_track) todo: fix
 
-                        time.sleep(self.MAIN_SLEEP_SEC)
-                except pypresence.exceptions.PipeClosed:
-                    logger.warning(
-                        "Lost connection to Discord, attempting to reconnect..."
-                    )
-                    time.sleep(1)
-                except pypresence.exceptions.DiscordNotFound:
-                    logger.warning("Couldn't find Discord, is it open? Trying again...")
-                    time.sleep(3)
-                except pypresence.exceptions.DiscordError as e:
-                    logger.warning(e)
-                    time.sleep(1)
-
-                self.discord_rpc.close()
-                logger.debug("Closed Discord RPC")
-
-                self.music_sources.stop()
+                        self.log_stats()
+
+                        changes.wait(version, self.get_wait_timeout())
+                finally:
+                    self.discord_rpc.close()
+                    logger.debug("Closed Discord RPC")
+
+                    self.music_sources.stop()
             except Exception as e:
                 logger.error(f"Unexpected error in main loop: {e}")
                 time.sleep(5)
@@ -86,6 +86,35 @@ class MusicTracker:
         if self.icon:
             self.icon.stop()
 
+        self.log_stats(force=True)
+
+    def get_wait_timeout(self) -> float:
+        timeout: float = self.MAX_WAIT_SEC
+
+        deadlines = [
+            track_registry.get_next_deadline(),
+            self.discord_rpc and self.discord_rpc.get_next_deadline(),
+            self.stats and self.next_stats_time,
+        ]
+
+        now = datetime.datetime.now()
+        for deadline in deadlines:
+            if deadline:
+                timeout = min(timeout, (deadline - now).total_seconds())
+
+        return max(timeout, 0)
+
+    def log_stats(self, force=False):
+        if not self.stats:
+            return
+
+        now = datetime.datetime.now()
+        if not force and now < self.next_stats_time:
+            return
+
+        self.next_stats_time = now + datetime.timedelta(seconds=self.STATS_GAP_SEC)
+        logger.info(f"Stats:\n{metrics.summarise() or 'nothing yet'}")
+
 
 def get_config(current_config=None):
     while True:
@@ -103,7 +132,17 @@ def get_config(current_config=None):
 
 
 def main():
-    tracker = MusicTracker()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="log timings and counters every minute and on exit",
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+
+    tracker = MusicTracker(stats=args.stats)
     tracker.run()
 
 
@@ -0,0 +1,180 @@
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .. import CONFIG_DIR
+from ..metrics import cover_art_lookups
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = CONFIG_DIR / "cover_art.sqlite3"
+
+MAX_ENTRIES = 2000
+HIT_TTL_SEC = 7 * 24 * 60 * 60  # album art basically never changes
+MISS_TTL_SEC = 60 * 60  # but it might get added later
+
+
+@dataclass
+class CoverArtCacheEntry:
+    art_url: str | None
+    timestamp: float  # when it was fetched
+    last_used: float
+    hits: int = 0  # lookups served from the cache
+    misses: int = 0  # lookups that had to go to the network
+
+
+class CoverArtCache:
+    """
+    LRU cache of cover art lookups, including ones that found nothing. Entries are
+    persisted to SQLite so restarts don't have to look everything up again.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = CACHE_PATH,
+        max_entries: int = MAX_ENTRIES,
+        hit_ttl_sec: float = HIT_TTL_SEC,
+        miss_ttl_sec: float = MISS_TTL_SEC,
+    ):
+        self.max_entries = max_entries
+        self.hit_ttl_sec = hit_ttl_sec
+        self.miss_ttl_sec = miss_ttl_sec
+
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, CoverArtCacheEntry] = OrderedDict()
+        self.dirty: set[str] = set()  # hit counts not written out yet
+        self.db: sqlite3.Connection | None = None
+
+        if path:
+            try:
+                self.open(path)
+            except sqlite3.Error as e:
+                logger.warning(f"Couldn't open cover art cache, not persisting it: {e}")
+                self.db = None
+
+    def open(self, path: Path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS cover_art ("
+            "key TEXT PRIMARY KEY, art_url TEXT, timestamp REAL, last_used REAL, "
+            "hits INTEGER, misses INTEGER)"
+        )
+
+        rows = self.db.execute(
+            "SELECT key, art_url, timestamp, last_used, hits, misses FROM cover_art "
+            "ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+
+        # oldest first so the most recently used end up at the back
+        for key, *fields in reversed(rows):
+            self.entries[key] = CoverArtCacheEntry(*fields)
+
+        # drop anything that didn't make the cut
+        self.db.execute(
+            "DELETE FROM cover_art WHERE key NOT IN "
+            "(SELECT key FROM cover_art ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self.db.commit()
+
+        logger.debug(f"Loaded {len(self.entries)} cached cover art entries")
+
+    def is_expired(self, entry: CoverArtCacheEntry, now: float) -> bool:
+        ttl = self.hit_ttl_sec if entry.art_url else self.miss_ttl_sec
+        return now - entry.timestamp >= ttl
+
+    def get(self, key: str) -> CoverArtCacheEntry | None:
+        """
+        Returns the cached entry, or None if it's missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.time()
+
+            if not entry or self.is_expired(entry, now):
+                cover_art_lookups.inc(result="miss")
+                return None
+
+            cover_art_lookups.inc(result="hit")
+
+            entry.hits += 1
+            entry.last_used = now
+            self.entries.move_to_end(key)
+            self.dirty.add(key)
+
+            return entry
+
+    def put(self, key: str, art_url: str | None):
+        with self.lock:
+            now = time.time()
+
+            entry = self.entries.pop(key, None) or CoverArtCacheEntry(None, now, now)
+            entry.art_url = art_url
+            entry.timestamp = now
+            entry.last_used = now
+            entry.misses += 1
+
+            self.entries[key] = entry
+            self.dirty.discard(key)
+
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted_key, _ = self.entries.popitem(last=False)
+                self.dirty.discard(evicted_key)
+                evicted.append(evicted_key)
+
+            self.write(key, entry, evicted)
+
+    def write(self, key: str, entry: CoverArtCacheEntry, evicted: list[str]):
+        if not self.db:
+            return
+
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO cover_art VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    entry.art_url,
+                    entry.timestamp,
+                    entry.last_used,
+                    entry.hits,
+                    entry.misses,
+                ),
+            )
+            self.db.executemany(
+                "DELETE FROM cover_art WHERE key = ?", [(k,) for k in evicted]
+            )
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write cover art cache: {e}")
+
+    def flush(self):
+        """
+        Write out hit counts and recency, which aren't saved on every lookup.
+        """
+        with self.lock:
+            if not self.db or not self.dirty:
+                return
+
+            try:
+                self.db.executemany(
+                    "UPDATE cover_art SET last_used = ?, hits = ? WHERE key = ?",
+                    [
+                        (self.entries[key].last_used, self.entries[key].hits, key)
+                        for key in self.dirty
+                    ],
+                )
+                self.db.commit()
+                self.dirty.clear()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write cover art cache: {e}")
+
+
+cover_art_cache = CoverArtCache()
+atexit.register(cover_art_cache.flush)
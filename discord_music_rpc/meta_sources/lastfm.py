@@ -1,37 +1,31 @@
 import logging
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import requests
 
-logger = logging.getLogger(__name__)
+from ..http_client import get_session
+from .cache import cover_art_cache
 
-BASE_URL = "http://ws.audioscrobbler.com/2.0/"
+logger = logging.getLogger(__name__)
 
+BASE_URL = "https://ws.audioscrobbler.com/2.0/"  # https so it shares connections with the source
 
-@dataclass
-class CoverArtCacheEntry:
-    art_url: str | None
-    timestamp: datetime
+# lookups run here so slow responses don't hold up whoever wanted the art
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cover-art")
+_in_flight: dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
 
 
-_cover_art_cache: dict[str, CoverArtCacheEntry] = {}
+def get_cover_art_key(song_title: str, artist: str, album: str | None) -> str:
+    # art comes from the album, so tracks off the same album can share it
+    return f"{artist}_{album}" if album else f"{artist}_{song_title}_"
 
 
-def get_lastfm_cover_art(
-    song_title: str, artist: str, album: str | None = None, api_key: str | None = None
+def fetch_lastfm_cover_art(
+    song_title: str, artist: str, album: str | None, api_key: str
 ) -> str | None:
-    key = f"{artist}_{song_title}_{album or ''}"
-
-    # check cache
-    if cached_entry := _cover_art_cache.get(key):
-        if datetime.now() - cached_entry.timestamp < timedelta(hours=1):
-            return cached_entry.art_url
-
-    if not api_key:
-        return None
-        # raise ValueError("Last.fm API key is required")
-
     params = {
         "method": "album.getInfo",
         "api_key": api_key,
@@ -41,27 +35,78 @@ def get_lastfm_cover_art(
         "format": "json",
     }
 
-    def fetch_art_url() -> str | None:
-        try:
-            logger.info(f"Fetching cover art for {artist} - {song_title} from Last.fm")
-            response = requests.get(BASE_URL, params=params)
-            response.raise_for_status()
-            data = response.json()
-
-            if images := data.get("album", {}).get("image"):
-                # get highest quality image
-                for img in reversed(images):
-                    if img["#text"]:
-                        return img["#text"]
-
-            return None
-        except (requests.RequestException, KeyError) as e:
-            logger.error(f"Error fetching cover art: {e}")
-            return None
-
-    art_url = fetch_art_url()
-    _cover_art_cache[key] = CoverArtCacheEntry(
-        art_url=art_url, timestamp=datetime.now()
-    )
+    art_url = None
+
+    try:
+        logger.info(f"Fetching cover art for {artist} - {song_title} from Last.fm")
+        response = get_session().get(BASE_URL, params=params)
+        response.raise_for_status()
+        data = response.json()
 
+        if images := data.get("album", {}).get("image"):
+            # get highest quality image
+            for img in reversed(images):
+                if img["#text"]:
+                    art_url = img["#text"]
+                    break
+    except (requests.RequestException, KeyError) as e:
+        logger.error(f"Error fetching cover art: {e}")
+
+    cover_art_cache.put(get_cover_art_key(song_title, artist, album), art_url)
     return art_url
+
+
+def request_lastfm_cover_art(
+    song_title: str,
+    artist: str,
+    album: str | None = None,
+    api_key: str | None = None,
+    on_done: Callable[[str | None], None] | None = None,
+) -> str | None:
+    """
+    Returns cached art straight away, otherwise returns None and looks it up
+    in the background, calling `on_done` with the result once it's in.
+    """
+    key = get_cover_art_key(song_title, artist, album)
+
+    if cached_entry := cover_art_cache.get(key):
+        return cached_entry.art_url
+
+    if not api_key:
+        return None
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+
+        if not future:
+            future = _executor.submit(
+                fetch_lastfm_cover_art, song_title, artist, album, api_key
+            )
+            _in_flight[key] = future
+            future.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    if on_done:
+        future.add_done_callback(lambda f: on_done(f.result()))
+
+    return None
+
+
+def prefetch_lastfm_cover_art(
+    get_upcoming: Callable[[], Iterable[tuple[str, str, str | None]]],
+    api_key: str | None = None,
+):
+    """
+    Warms the cache for tracks that are about to play. `get_upcoming` is called in
+    the background and returns (song_title, artist, album) for each of them.
+    """
+    if not api_key:
+        return
+
+    def prefetch():
+        try:
+            for song_title, artist, album in get_upcoming():
+                request_lastfm_cover_art(song_title, artist, album, api_key)
+        except Exception as e:
+            logger.debug(f"Failed to prefetch cover art: {e}")
+
+    _executor.submit(prefetch)
@@ -0,0 +1,309 @@
+import bisect
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import MetricsConfig
+
+logger = logging.getLogger(__name__)
+
+# seconds, covers everything from ipc writes to slow http requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = (*labels, *extra)
+    if not pairs:
+        return ""
+
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def get_labels(labels: dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        """
+        Sample lines in the prometheus text format.
+        """
+        pass
+
+    @abstractmethod
+    def summarise(self) -> list[str]:
+        """
+        Human readable lines for the --stats log.
+        """
+        pass
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = get_labels(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self.lock:
+            return [
+                f"{self.name}{format_labels(labels)} {value}"
+                for labels, value in self.values.items()
+            ]
+
+    def summarise(self) -> list[str]:
+        with self.lock:
+            return [
+                f"{self.name}{format_labels(labels)}: {value:g}"
+                for labels, value in self.values.items()
+            ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[get_labels(labels)] = value
+
+
+class HistogramValues:
+    def __init__(self, bucket_count: int):
+        self.counts = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help)
+        self.buckets = buckets
+        self.values: dict[Labels, HistogramValues] = {}
+
+    def observe(self, value: float, **labels):
+        key = get_labels(labels)
+
+        with self.lock:
+            values = self.values.get(key)
+            if not values:
+                values = self.values[key] = HistogramValues(len(self.buckets))
+
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                values.counts[index] += 1
+
+            values.count += 1
+            values.sum += value
+            values.max = max(values.max, value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = []
+
+        with self.lock:
+            for labels, values in self.values.items():
+                cumulative = 0
+                for bucket, count in zip(self.buckets, values.counts, strict=True):
+                    cumulative += count
+                    bucket_labels = format_labels(labels, (("le", f"{bucket:g}"),))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+
+                inf_labels = format_labels(labels, (("le", "+Inf"),))
+                lines += [
+                    f"{self.name}_bucket{inf_labels} {values.count}",
+                    f"{self.name}_sum{format_labels(labels)} {values.sum}",
+                    f"{self.name}_count{format_labels(labels)} {values.count}",
+                ]
+
+        return lines
+
+    def summarise(self) -> list[str]:
+        with self.lock:
+            return [
+                f"{self.name}{format_labels(labels)}: {values.count} samples, "
+                f"avg {values.sum / values.count:.3f}, max {values.max:.3f}"
+                for labels, values in self.values.items()
+                if values.count
+            ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, **kwargs))
+
+    def register[M: Metric](self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Everything in the prometheus text format.
+        """
+        lines = []
+
+        for metric in self.metrics:
+            lines += [
+                f"# HELP {metric.name} {metric.help}",
+                f"# TYPE {metric.name} {metric.type}",
+                *metric.render(),
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def summarise(self) -> str:
+        """
+        Short human readable version, for the log.
+        """
+        return "\n".join(line for metric in self.metrics for line in metric.summarise())
+
+
+metrics = MetricsRegistry()
+
+source_import_seconds = metrics.histogram(
+    "dmr_source_import_seconds", "Time taken to import a source's module"
+)
+source_poll_seconds = metrics.histogram(
+    "dmr_source_poll_seconds", "Time taken to poll a source"
+)
+source_poll_gap_seconds = metrics.histogram(
+    "dmr_source_poll_gap_seconds",
+    "Gap chosen before polling a source again",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120),
+)
+source_poll_errors = metrics.counter(
+    "dmr_source_poll_errors_total", "Source polls that raised"
+)
+main_loop_ticks = metrics.counter(
+    "dmr_main_loop_ticks_total", "Passes through the main loop"
+)
+track_changes = metrics.counter(
+    "dmr_track_changes_total", "Changes to the best track for a source/account"
+)
+discord_ipc_seconds = metrics.histogram(
+    "dmr_discord_ipc_seconds", "Time taken by Discord IPC calls"
+)
+discord_updates = metrics.counter(
+    "dmr_discord_updates_total", "Presence updates and clears sent to Discord"
+)
+discord_throttled = metrics.counter(
+    "dmr_discord_throttled_total", "Presence updates held back by the rate limit"
+)
+discord_errors = metrics.counter(
+    "dmr_discord_errors_total", "Failed Discord IPC connects and writes"
+)
+api_clients = metrics.gauge("dmr_api_clients", "Connected websocket clients")
+api_messages = metrics.counter(
+    "dmr_api_messages_total", "Websocket messages received, by outcome"
+)
+config_reload_seconds = metrics.histogram(
+    "dmr_config_reload_seconds", "Time taken to read and parse the config"
+)
+cover_art_lookups = metrics.counter(
+    "dmr_cover_art_lookups_total", "Cover art cache lookups, by result"
+)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body = metrics.render().encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds, don't spam the log
+
+
+class MetricsServer:
+    """
+    Serves /metrics while enabled in the config, moving when the address changes.
+    """
+
+    def __init__(self):
+        self.config: MetricsConfig | None = None
+        self.server: ThreadingHTTPServer | None = None
+
+    def apply(self, config: "MetricsConfig"):
+        if config == self.config:
+            return
+
+        self.stop()
+        self.config = config
+
+        if not config.enabled:
+            return
+
+        try:
+            self.server = ThreadingHTTPServer(
+                (config.host, config.port), MetricsHandler
+            )
+        except OSError as e:
+            logger.error(f"Failed to start metrics server: {e}")
+            return
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics available at http://{config.host}:{config.port}/metrics")
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+metrics_server = MetricsServer()
@@ -1,18 +1,38 @@
+import asyncio
+import dataclasses
 import datetime
 import logging
 import threading
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
+from ..metrics import source_poll_errors, source_poll_gap_seconds, source_poll_seconds
+
 if TYPE_CHECKING:
     from dataclasses import dataclass
+
+    from ..tracks import TrackRegistry
+    from .registry import SourceInfo
 else:
     from pydantic.dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
 ERROR_GAP = 5
+SOURCE_WORKERS = 4
+STOP_TIMEOUT = 5
+SEEK_TOLERANCE_MS = 3000
+
+# polls against the same service are at least this far apart, so accounts that
+# would otherwise line up don't all hit it at once
+POLL_SPACING_SEC = 0.1
+
+# adaptive sources poll at their normal rate from this long before a track should
+# end until this long after, everywhere else they can afford to be slow
+BOUNDARY_WINDOW_SEC = 5
+BOUNDARY_OVERRUN_SEC = 30
 
 
 @dataclass
@@ -24,6 +44,29 @@ class Track:
     image: str | None = None
     progress_ms: float | None = None
     duration_ms: float | None = None
+    progress_time: float | None = None  # unix time progress_ms was sampled at
+
+    def get_progress_ms(self, now: float | None = None) -> float | None:
+        """
+        Progress extrapolated to `now` (defaults to the current time), assuming
+        it's still playing.
+        """
+        if self.progress_ms is None or self.progress_time is None:
+            return self.progress_ms
+
+        now = time.time() if now is None else now
+        return self.progress_ms + (now - self.progress_time) * 1000
+
+    def get_remaining_sec(self, now: float | None = None) -> float | None:
+        progress_ms = self.get_progress_ms(now)
+
+        if progress_ms is None or not self.duration_ms:
+            return None
+
+        return (self.duration_ms - progress_ms) / 1000
+
+
+SourceKey = tuple[str, str | None]  # (source name, account name)
 
 
 @dataclass
@@ -31,18 +74,99 @@ class TrackWithSource:
     track: Track
     source: str
     source_image: str
+    account: str | None = None
+
+    @property
+    def key(self) -> SourceKey:
+        return self.source, self.account
+
+
+def has_track_changed(old: Track | None, new: Track | None) -> bool:
+    if old is None or new is None:
+        return old != new
+
+    if dataclasses.replace(
+        old, progress_ms=None, progress_time=None
+    ) != dataclasses.replace(new, progress_ms=None, progress_time=None):
+        return True
+
+    if (
+        old.progress_ms is None
+        or new.progress_ms is None
+        or old.progress_time is None
+        or new.progress_time is None
+    ):
+        return old.progress_ms != new.progress_ms
+
+    # progress moving along with the clock isn't a change, a seek is
+    expected_progress_ms = old.get_progress_ms(new.progress_time)
+    assert expected_progress_ms is not None
+    return abs(new.progress_ms - expected_progress_ms) > SEEK_TOLERANCE_MS
+
+
+def get_adaptive_gap(
+    update_gap: float,
+    max_gap: float,
+    remaining_sec: float | None,
+    unchanged_polls: int,
+) -> float:
+    """
+    Poll slowly mid-track and quickly around where the track should end. Without
+    anything to predict with (idle, no duration), back off the longer nothing
+    changes.
+    """
+    max_gap = max(update_gap, max_gap)
+
+    if remaining_sec is None:
+        return min(update_gap * 2**unchanged_polls, max_gap)
+
+    if remaining_sec > BOUNDARY_WINDOW_SEC:
+        return min(remaining_sec - BOUNDARY_WINDOW_SEC, max_gap)
+
+    if remaining_sec > -BOUNDARY_OVERRUN_SEC:
+        return update_gap
+
+    # well past where it should have ended, probably paused
+    return max_gap
+
+
+class PollScheduler:
+    """
+    Hands out poll slots per service, at least POLL_SPACING_SEC apart. Only used
+    from the manager's event loop.
+    """
+
+    def __init__(self, spacing_sec: float = POLL_SPACING_SEC):
+        self.spacing_sec = spacing_sec
+        self.next_slots: dict[str, float] = {}
+
+    async def wait_turn(self, service: str):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        slot = max(now, self.next_slots.get(service, now))
+        self.next_slots[service] = slot + self.spacing_sec
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
 
 
 class BaseSource(ABC):
-    from discord_music_rpc.config import Config
+    from discord_music_rpc.config import AccountConfig, Config
 
     config: Config
-    alive: bool = True
+    account: AccountConfig
     track: Track | None = None
     track_time: datetime.datetime | None = None
+    registry: "TrackRegistry | None" = None  # where published tracks go
+    # polled tracks drop out if the source stops publishing them, pushed ones are
+    # cleared by the source itself
+    expires = True
 
-    def __init__(self, config, update_gap=1):
+    def __init__(self, config, account, update_gap=1):
+        self.account = account
         self.update_gap = update_gap
+        self.current_gap = update_gap
         self.update_config(config)
 
     def update_config(self, config):
@@ -65,6 +189,20 @@ class BaseSource(ABC):
         """
         pass
 
+    @property
+    def key(self) -> SourceKey:
+        return self.source_name, self.account.name
+
+    @property
+    def display_name(self) -> str:
+        """
+        Name to use in logs, includes the account when there might be several.
+        """
+        if self.account.name:
+            return f"{self.source_name} ({self.account.name})"
+
+        return self.source_name
+
     @abstractmethod
     def initialize_client(self):
         """
@@ -80,65 +218,184 @@ class BaseSource(ABC):
         """
         pass
 
-    def update_loop(self):
-        while self.alive:
+    def get_update_gap(self, track: Track | None) -> float:
+        """
+        Seconds to wait before polling again after getting `track`.
+        """
+        return self.update_gap
+
+    def publish(self, track: Track | None, update_gap: float | None = None):
+        self.track_time = datetime.datetime.now()
+        self.current_gap = update_gap or self.update_gap
+
+        if track and track.progress_ms is not None and track.progress_time is None:
+            track.progress_time = self.track_time.timestamp()
+
+        self.track = track
+
+        if self.registry:
+            self.registry.put(
+                self,
+                TrackWithSource(
+                    track, self.source_name, self.source_image, self.account.name
+                )
+                if track
+                else None,
+                self.current_gap * 3 if self.expires else None,
+            )  # *3 cause idk something might happen. i dont even know if checking update time really matters
+
+    async def get_current_track_async(self) -> Track | None:
+        """
+        Async version of get_current_track. Runs get_current_track on the
+        manager's worker threads unless a source overrides it.
+        """
+        return await asyncio.to_thread(self.get_current_track)
+
+    async def run(self, scheduler: PollScheduler):
+        """
+        Polls the source until cancelled. Each poll is scheduled relative to when
+        the previous one started, so slow requests don't push the schedule back.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+
+        while True:
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            await scheduler.wait_turn(self.source_name)
+            started = loop.time()
+
+            labels = {"source": self.source_name, "account": self.account.name or ""}
+
             try:
-                self.track = self.get_current_track()
-                self.track_time = datetime.datetime.now()
+                with source_poll_seconds.time(**labels):
+                    track = await self.get_current_track_async()
 
-                time.sleep(self.update_gap)
+                update_gap = self.get_update_gap(track)
+                self.publish(track, update_gap)
             except Exception as e:
                 logger.warning(
-                    f"Source {self.source_name} failed to update:\n"
+                    f"Source {self.display_name} failed to update:\n"
                     f"{type(e).__name__}: {e}"
                 )
-                time.sleep(ERROR_GAP)
+                source_poll_errors.inc(1, **labels)
+                update_gap = ERROR_GAP
+
+            source_poll_gap_seconds.observe(update_gap, **labels)
+
+            deadline = started + update_gap
 
 
 class MusicSourceManager:
     def __init__(self, config):
-        from .lastfm import LastFmSource
-        from .plex import PlexSource
-        from .spotify import SpotifySource
+        from ..tracks import track_registry
+
+        self.config = config
+        self.registry = track_registry
 
-        # Sources ordered by priority (highest to lowest)
+        # Sources ordered by priority (highest to lowest), filled in once the
+        # loop is up
         self.sources: list[BaseSource] = []
 
-        if config.spotify.enabled:
-            self.sources.append(
-                SpotifySource(config, 2)
-            )  # highest priority (has progress info)
+        self.scheduler = PollScheduler()
 
-        if config.plex.enabled:
-            self.sources.append(PlexSource(config))
+        # every source runs on one event loop, blocking sdk calls go to a fixed
+        # pool of workers - so the thread count doesn't grow with the sources
+        self.executor = ThreadPoolExecutor(
+            max_workers=SOURCE_WORKERS, thread_name_prefix="source"
+        )
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.task = self.loop.create_task(self.run_sources())
 
-        if config.lastfm.enabled:
-            self.sources.append(LastFmSource(config))
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
 
-        for source in self.sources:
-            threading.Thread(target=source.update_loop, daemon=True).start()
+    def create_source(self, info: "SourceInfo", account) -> BaseSource | None:
+        try:
+            return info.create_poller(self.config, account)
+        except Exception as e:
+            logger.error(f"Failed to load {info.name} source: {e}")
+            return None
 
-    def stop(self):
-        for source in self.sources:
-            source.alive = False
+    async def create_sources(self):
+        """
+        Import and set up every enabled source. Importing sdks and connecting
+        clients is slow, so it happens here on the workers rather than holding
+        up the main loop, and all at once.
+        """
+        from .registry import POLLED_SOURCES
 
-    def get_current_tracks(self) -> list[TrackWithSource]:
-        tracks: list[TrackWithSource] = []
+        accounts = [
+            (info, account)
+            for info in POLLED_SOURCES
+            for account in info.get_accounts(self.config)
+        ]
 
-        for source in self.sources:
-            if not source.track or not source.track_time:
-                continue
+        if not accounts:
+            return
 
-            update_gap_timedelta = datetime.timedelta(
-                seconds=source.update_gap * 3
-            )  # *3 cause idk something might happen. i dont even know if checking update time really matters
-            time_diff = datetime.datetime.now() - source.track_time
+        from .. import http_client
 
-            if time_diff <= update_gap_timedelta:
-                tracks.append(
-                    TrackWithSource(
-                        source.track, source.source_name, source.source_image
-                    )
-                )
+        http_client.configure(self.config.http)
+
+        sources = await asyncio.gather(
+            *(
+                asyncio.to_thread(self.create_source, info, account)
+                for info, account in accounts
+            )
+        )
+
+        for source in sources:
+            if source:
+                self.add_source(source)
+
+    def add_source(self, source: BaseSource):
+        if any(existing.key == source.key for existing in self.sources):
+            logger.warning(
+                f"Ignoring duplicate {source.display_name} account, give each "
+                "account a different name"
+            )
+            return
+
+        self.sources.append(source)
+        source.registry = self.registry
 
-        return tracks
+    async def run_sources(self):
+        await self.create_sources()
+        await asyncio.gather(*(source.run(self.scheduler) for source in self.sources))
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # libraries can leave tasks of their own behind (keepalives etc.)
+            leftover = asyncio.all_tasks(self.loop)
+            for task in leftover:
+                task.cancel()
+
+            self.loop.run_until_complete(
+                asyncio.gather(*leftover, return_exceptions=True)
+            )
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def stop(self):
+        """
+        Cancel every source and wait for the loop to wind down, so nothing from
+        this manager keeps running alongside its replacement.
+        """
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join(STOP_TIMEOUT)
+
+        # requests already on a worker finish in the background, their results
+        # have nowhere to go
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+        for source in self.sources:
+            source.registry = None
+            self.registry.put(source, None)
@@ -1,13 +1,37 @@
+import hashlib
 import logging
+import time
+from functools import lru_cache
 
-import requests
-
-from . import BaseSource, Track
+from ..config import LastFmAccountConfig
+from ..http_client import get_session
+from . import BaseSource, Track, get_adaptive_gap
 
 logger = logging.getLogger(__name__)
 
+API_URL = "https://ws.audioscrobbler.com/2.0/"
+
+
+@lru_cache(maxsize=256)
+def get_track_duration_ms(api_key: str, artist: str, name: str) -> float | None:
+    params = {
+        "method": "track.getInfo",
+        "api_key": api_key,
+        "artist": artist,
+        "track": name,
+        "format": "json",
+    }
+
+    response = get_session().get(API_URL, params=params)
+    response.raise_for_status()
+
+    duration_ms = response.json().get("track", {}).get("duration")
+    return float(duration_ms) if duration_ms and float(duration_ms) > 0 else None
+
 
 class LastFmSource(BaseSource):
+    account: LastFmAccountConfig
+
     @property
     def source_name(self):
         return "Last.fm"
@@ -19,18 +43,39 @@ class LastFmSource(BaseSource):
         )
 
     def initialize_client(self):
-        self.username = self.config.lastfm.username
-        self.api_key = self.config.lastfm.api_key
+        self.username = self.account.username
+        self.api_key = self.account.api_key
         self.client = None
 
+        self.etag: str | None = None
+        self.response_digest: bytes | None = None
+        self.last_track: Track | None = None
+        self.track_started: float | None = None
+        self.unchanged_polls = 0
+
         if not self.username or not self.api_key:
-            logger.debug(f"{self.source_name} credentials not configured.")
+            logger.debug(f"{self.display_name} credentials not configured.")
         else:
             self.client = True  # Placeholder to signify initialization success
 
+    def get_update_gap(self, track: Track | None) -> float:
+        remaining_sec = None
+
+        if track and track.duration_ms and self.track_started is not None:
+            remaining_sec = (
+                self.track_started + track.duration_ms / 1000 - time.monotonic()
+            )
+
+        return get_adaptive_gap(
+            self.update_gap,
+            self.account.max_update_gap,
+            remaining_sec,
+            self.unchanged_polls,
+        )
+
     def get_current_track(self) -> Track | None:
         if not self.client:
-            logger.debug(f"{self.source_name} credentials not configured.")
+            logger.debug(f"{self.display_name} credentials not configured.")
             return None
 
         params = {
@@ -42,28 +87,64 @@ class LastFmSource(BaseSource):
         }
 
         try:
-            response = requests.get("https://ws.audioscrobbler.com/2.0/", params=params)
+            response = get_session().get(
+                API_URL,
+                params=params,
+                headers={"If-None-Match": self.etag} if self.etag else None,
+            )
+
+            if response.status_code == 304:
+                self.unchanged_polls += 1
+                return self.last_track
+
             response.raise_for_status()
+            self.etag = response.headers.get("ETag")
 
-            data = response.json()
-
-            track = data["recenttracks"]["track"][0]
-            if "@attr" in track and track["@attr"].get("nowplaying") == "true":
-                return Track(
-                    name=track["name"],
-                    artist=track["artist"]["#text"],
-                    album=track["album"]["#text"],
-                    url=track["url"],
-                    image=next(
-                        (
-                            img["#text"]
-                            for img in track["image"]
-                            if img["size"] == "large"
-                        ),
-                        None,
-                    ),
-                )
-            return None
+            # same bytes as last time, skip parsing it all again
+            digest = hashlib.sha256(response.content).digest()
+            if digest == self.response_digest:
+                self.unchanged_polls += 1
+                return self.last_track
+
+            self.response_digest = digest
+            self.unchanged_polls = 0
+            self.last_track = self.parse_track(response.json())
+            return self.last_track
         except Exception as e:
-            logger.error(f"Error fetching {self.source_name} track: {e}")
+            logger.error(f"Error fetching {self.display_name} track: {e}")
             return None
+
+    def parse_track(self, data) -> Track | None:
+        track = data["recenttracks"]["track"][0]
+        if "@attr" not in track or track["@attr"].get("nowplaying") != "true":
+            self.track_started = None
+            return None
+
+        name = track["name"]
+        artist = track["artist"]["#text"]
+
+        if (
+            not self.last_track
+            or self.last_track.name != name
+            or self.last_track.artist != artist
+        ):
+            self.track_started = time.monotonic()
+
+        try:
+            assert self.api_key
+            duration_ms = get_track_duration_ms(self.api_key, artist, name)
+        except Exception as e:
+            logger.debug(f"Couldn't get duration for {artist} - {name}: {e}")
+            duration_ms = None
+
+        return Track(
+            name=name,
+            artist=artist,
+            album=track["album"]["#text"],
+            url=track["url"],
+            image=next(
+                (img["#text"] for img in track["image"] if img["size"] == "large"),
+                None,
+            ),
+            duration_ms=duration_ms,
+        )
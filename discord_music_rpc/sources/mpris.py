@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from ..config import MprisConfig
+from . import ERROR_GAP, BaseSource, PollScheduler, Track
+
+try:
+    from jeepney import (
+        DBusAddress,
+        DBusErrorResponse,
+        HeaderFields,
+        MatchRule,
+        Message,
+        Properties,
+        message_bus,
+    )
+    from jeepney.io.asyncio import DBusRouter, open_dbus_router
+    from jeepney.wrappers import unwrap_msg
+except ImportError as e:
+    raise ImportError(
+        "MPRIS support needs jeepney, install discord-music-rpc[mpris]"
+    ) from e
+
+logger = logging.getLogger(__name__)
+
+MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+BUS_NAME = "org.freedesktop.DBus"
+
+SIGNAL_QUEUE_SIZE = 256  # signals that arrive while we're busy, past this they're lost
+
+# urls discord can actually load, players often give file:// art
+WEB_SCHEMES = ("http://", "https://")
+
+
+@dataclass
+class PlayerState:
+    name: str  # well-known bus name, e.g. org.mpris.MediaPlayer2.mpv
+    status: str = "Stopped"
+    metadata: dict = field(default_factory=dict)
+    position_us: int | None = None
+    position_time: float = 0  # when position_us was right
+    playing_since: float = 0  # the most recently started player is shown
+
+    @property
+    def identity(self) -> str:
+        # instance suffixes like firefox.instance_1_23 don't matter
+        return self.name.removeprefix(MPRIS_PREFIX).split(".")[0]
+
+
+def get_web_url(url) -> str | None:
+    return url if isinstance(url, str) and url.startswith(WEB_SCHEMES) else None
+
+
+class MprisSource(BaseSource):
+    """
+    Local players on the session bus. Nothing is polled: players signal changes
+    to their status and metadata, and seeks. Position is only read when playback
+    jumps, and extrapolated from then on like every other source.
+    """
+
+    account: MprisConfig
+    expires = False  # nothing gets published while idle, tracks stay until cleared
+
+    @property
+    def source_name(self):
+        return "MPRIS"
+
+    @property
+    def source_image(self):
+        return "https://upload.wikimedia.org/wikipedia/commons/thumb/0/02/CD_icon_test.svg/240px-CD_icon_test.svg.png"
+
+    def initialize_client(self):
+        self.client = None  # the bus connection only lives while run is
+        self.players: dict[str, PlayerState] = {}  # by unique bus name
+
+    def get_current_track(self) -> Track | None:
+        return self.get_player_track()
+
+    async def run(self, scheduler: PollScheduler):
+        # runs until the source is cancelled
+        while True:
+            try:
+                async with open_dbus_router(bus="SESSION") as router:
+                    await self.listen(router)
+            except Exception as e:
+                logger.warning(
+                    f"{self.display_name} unavailable, retrying in {ERROR_GAP}s: {e}"
+                )
+            finally:
+                self.players.clear()
+                self.publish(None)
+
+            await asyncio.sleep(ERROR_GAP)
+
+    async def listen(self, router: DBusRouter):
+        rules = [
+            MatchRule(
+                type="signal",
+                interface=PROPERTIES_INTERFACE,
+                member="PropertiesChanged",
+                path=MPRIS_PATH,
+            ),
+            MatchRule(
+                type="signal",
+                interface=PLAYER_INTERFACE,
+                member="Seeked",
+                path=MPRIS_PATH,
+            ),
+            MatchRule(
+                type="signal",
+                sender=BUS_NAME,
+                interface=BUS_NAME,
+                member="NameOwnerChanged",
+            ),
+        ]
+        rules[2].add_arg_condition(0, MPRIS_PREFIX.rstrip("."), kind="namespace")
+
+        # start collecting signals before reading state, so nothing in between
+        # gets missed
+        with router.filter(
+            MatchRule(type="signal"), bufsize=SIGNAL_QUEUE_SIZE
+        ) as queue:
+            for rule in rules:
+                await router.send_and_get_reply(message_bus.AddMatch(rule))
+
+            (names,) = unwrap_msg(
+                await router.send_and_get_reply(message_bus.ListNames())
+            )
+            for name in names:
+                if name.startswith(MPRIS_PREFIX):
+                    await self.add_player(router, name)
+
+            logger.info(f"Listening for {self.display_name} players")
+            self.publish(self.get_player_track())
+
+            while True:
+                if await self.handle_signal(router, await queue.get()):
+                    self.publish(self.get_player_track())
+
+    def is_wanted(self, player: PlayerState) -> bool:
+        if self.account.players and player.identity not in self.account.players:
+            return False
+
+        return player.identity not in self.account.ignored_players
+
+    async def add_player(self, router: DBusRouter, name: str, owner: str | None = None):
+        player = PlayerState(name)
+        if not self.is_wanted(player):
+            return
+
+        try:
+            if owner is None:
+                (owner,) = unwrap_msg(
+                    await router.send_and_get_reply(message_bus.GetNameOwner(name))
+                )
+
+            (properties,) = unwrap_msg(
+                await router.send_and_get_reply(
+                    Properties(self.get_address(name)).get_all()
+                )
+            )
+        except DBusErrorResponse as e:
+            logger.debug(f"Couldn't read {self.display_name} player {name}: {e}")
+            return
+
+        self.update_player(player, properties)
+        self.players[owner] = player
+
+        logger.debug(f"Found {self.display_name} player {player.identity}")
+
+    async def handle_signal(self, router: DBusRouter, message: Message) -> bool:
+        """
+        Updates player state from a signal, returns whether anything changed.
+        """
+        fields = message.header.fields
+        member = fields.get(HeaderFields.member)
+
+        if member == "NameOwnerChanged":
+            name, old_owner, new_owner = message.body
+            if not name.startswith(MPRIS_PREFIX):
+                return False
+
+            changed = self.players.pop(old_owner, None) is not None
+            if new_owner:
+                await self.add_player(router, name, new_owner)
+                changed = True
+
+            return changed
+
+        player = self.players.get(fields.get(HeaderFields.sender))
+        if not player or fields.get(HeaderFields.path) != MPRIS_PATH:
+            return False
+
+        if member == "Seeked":
+            (player.position_us,) = message.body
+            player.position_time = time.time()
+            return True
+
+        if member == "PropertiesChanged":
+            interface, changed_properties, _invalidated = message.body
+            if interface != PLAYER_INTERFACE:
+                return False
+
+            self.update_player(player, changed_properties)
+
+            # position isn't signalled as it moves, only read it when it jumps
+            if (
+                "PlaybackStatus" in changed_properties
+                or "Metadata" in changed_properties
+            ):
+                await self.read_position(router, player)
+
+            return True
+
+        return False
+
+    def update_player(self, player: PlayerState, properties: dict):
+        now = time.time()
+
+        if "PlaybackStatus" in properties:
+            _signature, status = properties["PlaybackStatus"]
+            if status == "Playing" and player.status != "Playing":
+                player.playing_since = now
+            player.status = status
+
+        if "Metadata" in properties:
+            _signature, metadata = properties["Metadata"]
+            player.metadata = {key: value for key, (_sig, value) in metadata.items()}
+
+        if "Position" in properties:
+            _signature, player.position_us = properties["Position"]
+            player.position_time = now
+
+    async def read_position(self, router: DBusRouter, player: PlayerState):
+        try:
+            ((_signature, position),) = unwrap_msg(
+                await router.send_and_get_reply(
+                    Properties(self.get_address(player.name)).get("Position")
+                )
+            )
+        except DBusErrorResponse:
+            # not every player supports it, progress just isn't shown
+            player.position_us = None
+            return
+
+        player.position_us = position
+        player.position_time = time.time()
+
+    @staticmethod
+    def get_address(name: str) -> DBusAddress:
+        return DBusAddress(MPRIS_PATH, bus_name=name, interface=PLAYER_INTERFACE)
+
+    def get_player_track(self) -> Track | None:
+        playing = [
+            player
+            for player in self.players.values()
+            if player.status == "Playing" and player.metadata.get("xesam:title")
+        ]
+
+        if not playing:
+            return None
+
+        player = max(playing, key=lambda player: player.playing_since)
+        metadata = player.metadata
+        length_us = metadata.get("mpris:length")
+
+        return Track(
+            name=metadata["xesam:title"],
+            # videos and streams often have no artist, say where it's playing instead
+            artist=", ".join(metadata.get("xesam:artist") or []) or player.identity,
+            album=metadata.get("xesam:album") or None,
+            url=get_web_url(metadata.get("xesam:url")),
+            image=get_web_url(metadata.get("mpris:artUrl")),
+            progress_ms=player.position_us / 1000
+            if player.position_us is not None
+            else None,
+            duration_ms=length_us / 1000 if length_us else None,
+            progress_time=player.position_time
+            if player.position_us is not None
+            else None,
+        )
@@ -1,16 +1,49 @@
+import asyncio
+import dataclasses
+import json
 import logging
+import time
+from dataclasses import dataclass
+from functools import partial
 
-from plexapi.audio import Album, Artist
+from plexapi import utils
 from plexapi.audio import Track as PlexTrack
+from plexapi.playqueue import PlayQueue
 from plexapi.server import PlexServer
+from websockets.asyncio.client import connect
 
-from ..meta_sources.lastfm import get_lastfm_cover_art
-from . import BaseSource, Track
+from ..config import PlexAccountConfig
+from ..http_client import get_session
+from ..meta_sources.lastfm import prefetch_lastfm_cover_art, request_lastfm_cover_art
+from ..utils import TtlLruCache
+from . import ERROR_GAP, BaseSource, PollScheduler, Track
 
 logger = logging.getLogger(__name__)
 
+PREFETCH_COUNT = 3
+
+SESSIONS_PATH = "/status/sessions"
+NOTIFICATIONS_PATH = "/:/websockets/notifications"
+PUSH_UPDATE_GAP = 5
+
+METADATA_CACHE_SIZE = 256
+METADATA_TTL_SEC = 60 * 60
+
+
+@dataclass
+class PlexSession:
+    rating_key: str
+    state: str
+    view_offset: float | None
+    progress_time: float
+    play_queue_id: int | None = None
+    play_queue_item_id: int | None = None
+
 
 class PlexSource(BaseSource):
+    account: PlexAccountConfig
+    loop: asyncio.AbstractEventLoop | None = None  # the one run is on
+
     @property
     def source_name(self):
         return "Plex"
@@ -21,51 +54,351 @@ class PlexSource(BaseSource):
 
     def initialize_client(self):
         self.client = None
+        self.prefetched_item: tuple[int, int] | None = None
+
+        # push mode state, kept up to date from the server's notifications
+        self.sessions: dict[str, PlexSession] = {}
+
+        self.metadata = TtlLruCache[str, PlexTrack](
+            METADATA_CACHE_SIZE, METADATA_TTL_SEC
+        )
+        self.artists = TtlLruCache[int, str](METADATA_CACHE_SIZE, METADATA_TTL_SEC)
+        self.albums = TtlLruCache[int, str](METADATA_CACHE_SIZE, METADATA_TTL_SEC)
+        self.listening = False
 
-        if not self.config.plex.server_url or not self.config.plex.token:
-            logger.debug(f"{self.source_name} credentials not configured.")
+        if not self.account.server_url or not self.account.token:
+            logger.debug(f"{self.display_name} credentials not configured.")
         else:
             try:
                 self.client = PlexServer(
-                    self.config.plex.server_url, self.config.plex.token
+                    self.account.server_url,
+                    self.account.token,
+                    session=get_session(),
+                    timeout=self.config.http.timeout_sec,
                 )
             except Exception as e:
-                logger.warning(f"Failed to initialise {self.source_name}: {e}")
+                logger.warning(f"Failed to initialise {self.display_name}: {e}")
+
+        self.library_keys = self.resolve_library_keys()
+
+    def get_update_gap(self, track: Track | None) -> float:
+        # while we're getting pushed updates, polling only reads local state
+        return PUSH_UPDATE_GAP if self.listening else self.update_gap
 
     def get_current_track(self) -> Track | None:
         if not self.client:
-            logger.debug(f"{self.source_name} credentials not configured.")
+            logger.debug(f"{self.display_name} credentials not configured.")
             return None
 
-        for session in self.client.sessions():
-            if session.type != "track":
-                continue
+        if self.listening:
+            return self.get_session_track()
+
+        if self.library_keys is None:
+            self.library_keys = self.resolve_library_keys()
+
+        if not self.library_keys:
+            return None
+
+        # filter on the raw xml so sessions we don't care about (videos, other
+        # libraries, paused) never get built into plexapi objects
+        tracks: list[PlexTrack] = self.client.fetchItems(
+            SESSIONS_PATH,
+            type="track",
+            librarySectionID__in=self.library_keys,
+            Player__state="playing",
+        )
+
+        if not tracks:
+            return None
+
+        self.resolve_titles(tracks)
+
+        track = tracks[0]
+        return self.make_track(
+            track,
+            track.viewOffset,
+            None,
+            get_play_queue_id(track),
+            track.playQueueItemID,
+        )
+
+    def resolve_library_keys(self) -> frozenset[str] | None:
+        """
+        Section keys of the configured libraries, as they appear in session
+        payloads. None if they couldn't be looked up.
+        """
+        if not self.client:
+            return None
+
+        try:
+            return frozenset(
+                str(section.key)
+                for section in self.client.library.sections()
+                if section.title in self.account.libraries
+            )
+        except Exception as e:
+            logger.warning(f"Failed to look up {self.display_name} libraries: {e}")
+            return None
+
+    def resolve_titles(self, tracks: list[PlexTrack]):
+        """
+        Make sure artist and album titles for `tracks` are cached, fetching any
+        that are missing in a single request.
+        """
+        missing: set[int] = set()
+
+        for track in tracks:
+            for key, title, cache in (
+                (track.grandparentRatingKey, track.grandparentTitle, self.artists),
+                (track.parentRatingKey, track.parentTitle, self.albums),
+            ):
+                if not key or cache.get(key) is not None:
+                    continue
+
+                if title:
+                    cache.put(key, title)
+                else:
+                    missing.add(key)
+
+        if not missing:
+            return
+
+        assert self.client
+        try:
+            for item in self.client.fetchItems(sorted(missing)):
+                cache = self.artists if item.type == "artist" else self.albums
+                cache.put(item.ratingKey, item.title)
+        except Exception as e:
+            logger.warning(f"Failed to fetch {self.display_name} items {missing}: {e}")
+
+    def resolve_metadata(self, rating_keys: list[str]):
+        """
+        Make sure metadata for `rating_keys` is cached, fetching any that are
+        missing in a single request.
+        """
+        missing = sorted(
+            {int(key) for key in rating_keys if self.metadata.get(key) is None}
+        )
+
+        if not missing:
+            return
+
+        assert self.client
+        try:
+            for item in self.client.fetchItems(missing):
+                self.metadata.put(str(item.ratingKey), item)
+        except Exception as e:
+            logger.warning(f"Failed to fetch {self.display_name} items {missing}: {e}")
+
+    def make_track(
+        self,
+        track: PlexTrack,
+        view_offset: float | None,
+        progress_time: float | None,
+        play_queue_id: int | None,
+        play_queue_item_id: int | None,
+    ) -> Track:
+        artist = self.artists.get(track.grandparentRatingKey) or track.grandparentTitle
+        album = self.albums.get(track.parentRatingKey) or track.parentTitle
+
+        # don't wait on last.fm, show the track now and fill the art in later
+        image = request_lastfm_cover_art(
+            track.title,
+            artist,
+            album,
+            self.config.lastfm.api_key,
+            on_done=partial(self.on_cover_art, track.title, artist, album),
+        )
+
+        self.prefetch_upcoming(play_queue_id, play_queue_item_id)
+
+        return Track(
+            name=track.title,
+            artist=artist,
+            album=album,
+            url=None,  # todo: lastfm url?
+            image=image,
+            progress_ms=view_offset,
+            duration_ms=track.duration,
+            progress_time=progress_time,
+        )
+
+    async def run(self, scheduler: PollScheduler):
+        # cover art comes back on another thread and has to be published here
+        self.loop = asyncio.get_running_loop()
+
+        if not self.client or not self.account.push:
+            return await super().run(scheduler)
 
-            if (
-                not session.player.state == "playing"
-            ):  # idk if theres an easier way to do this
+        await asyncio.gather(super().run(scheduler), self.listen(self.client))
+
+    async def listen(self, client: PlexServer):
+        url = client.url(NOTIFICATIONS_PATH, includeToken=True).replace("http", "ws", 1)
+
+        # runs until the source is cancelled
+        while True:
+            try:
+                async with connect(
+                    url, open_timeout=self.config.http.timeout_sec
+                ) as websocket:
+                    logger.info(f"Listening for {self.display_name} notifications")
+
+                    await asyncio.to_thread(self.load_sessions, client)
+                    self.listening = True
+                    await self.publish_session_track()
+
+                    async for message in websocket:
+                        if self.handle_notification(json.loads(message)):
+                            await self.publish_session_track()
+            except Exception as e:
+                logger.warning(
+                    f"{self.display_name} notifications unavailable, polling instead: {e}"
+                )
+            finally:
+                self.listening = False
+
+            await asyncio.sleep(ERROR_GAP)
+
+    async def publish_session_track(self):
+        # may have to fetch metadata, keep it off the loop
+        track = await asyncio.to_thread(self.get_session_track)
+        self.publish(track, PUSH_UPDATE_GAP)
+
+    def load_sessions(self, client: PlexServer):
+        """
+        Catch up on whatever is already playing, notifications only tell us about
+        changes.
+        """
+        sessions = {}
+
+        for session in client.fetchItems(
+            SESSIONS_PATH, type="track", librarySectionID__in=self.library_keys or ()
+        ):
+            self.metadata.put(str(session.ratingKey), session)
+            sessions[str(session.sessionKey)] = PlexSession(
+                rating_key=str(session.ratingKey),
+                state=session.player.state,
+                view_offset=session.viewOffset,
+                progress_time=time.time(),
+                play_queue_id=get_play_queue_id(session),
+                play_queue_item_id=session.playQueueItemID,
+            )
+
+        self.sessions = sessions
+
+    def handle_notification(self, data) -> bool:
+        """
+        Updates session state from a notification, returns whether anything
+        changed.
+        """
+        container = data.get("NotificationContainer", {})
+        if container.get("type") != "playing":
+            return False
+
+        for notification in container.get("PlaySessionStateNotification", []):
+            session_key = str(notification["sessionKey"])
+
+            if notification["state"] == "stopped":
+                self.sessions.pop(session_key, None)
                 continue
 
-            track: PlexTrack = session
+            self.sessions[session_key] = PlexSession(
+                rating_key=str(notification["ratingKey"]),
+                state=notification["state"],
+                view_offset=notification.get("viewOffset"),
+                progress_time=time.time(),
+                play_queue_id=utils.cast(int, notification.get("playQueueID")),
+                play_queue_item_id=utils.cast(int, notification.get("playQueueItemID")),
+            )
+
+        return True
+
+    def get_session_track(self) -> Track | None:
+        sessions = [
+            session
+            for session in list(self.sessions.values())
+            if session.state == "playing"
+        ]
 
-            if track.librarySectionTitle not in self.config.plex.libraries:
+        self.resolve_metadata([session.rating_key for session in sessions])
+
+        candidates: list[tuple[PlexSession, PlexTrack]] = []
+
+        for session in sessions:
+            track = self.metadata.get(session.rating_key)
+
+            if not track or track.type != "track":
+                continue
+
+            if str(track.librarySectionID) not in (self.library_keys or ()):
                 continue
 
-            artist: Artist = track.artist()
-            album: Album = track.album()
+            candidates.append((session, track))
+
+        if not candidates:
+            return None
+
+        self.resolve_titles([track for _, track in candidates])
+
+        session, track = candidates[0]
+        return self.make_track(
+            track,
+            session.view_offset,
+            session.progress_time,
+            session.play_queue_id,
+            session.play_queue_item_id,
+        )
+
+    def on_cover_art(self, name: str, artist: str, album: str, art_url: str | None):
+        # called on a cover art thread, publish from the loop so it can't race
+        # a newer track being published there
+        if not art_url or not self.loop:
+            return
 
-            image = get_lastfm_cover_art(
-                track.title, artist.title, album.title, self.config.lastfm.api_key
+        try:
+            self.loop.call_soon_threadsafe(
+                self.publish_cover_art, name, artist, album, art_url
             )
+        except RuntimeError:
+            pass  # the source was stopped in the meantime
 
-            return Track(
-                name=track.title,
-                artist=artist.title,
-                album=album.title,
-                url=None,  # todo: lastfm url?
-                image=image,
-                progress_ms=track.viewOffset,
-                duration_ms=track.duration,
+    def publish_cover_art(self, name: str, artist: str, album: str, art_url: str):
+        track = self.track
+
+        if (
+            not track
+            or track.image
+            or (track.name, track.artist, track.album) != (name, artist, album)
+        ):
+            return
+
+        self.publish(dataclasses.replace(track, image=art_url), self.current_gap)
+
+    def prefetch_upcoming(self, play_queue_id: int | None, item_id: int | None):
+        if not play_queue_id or not item_id:
+            return
+
+        if self.prefetched_item == (play_queue_id, item_id):
+            return
+
+        self.prefetched_item = (play_queue_id, item_id)
+
+        def get_upcoming():
+            queue = PlayQueue.get(
+                self.client,
+                play_queue_id,
+                center=item_id,
+                window=PREFETCH_COUNT,
+                includeBefore=False,
             )
 
-        return None
+            for item in queue.items:
+                if item.type == "track":
+                    yield item.title, item.grandparentTitle, item.parentTitle
+
+        prefetch_lastfm_cover_art(get_upcoming, self.config.lastfm.api_key)
+
+
+def get_play_queue_id(session: PlexTrack) -> int | None:
+    # plexapi doesn't parse this one out
+    return utils.cast(int, session._data.attrib.get("playQueueID"))
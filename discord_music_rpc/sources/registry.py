@@ -0,0 +1,99 @@
+import importlib
+import logging
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import cache
+from typing import TYPE_CHECKING
+
+from pypresence import ActivityType
+
+from ..config import AccountConfig, Config, SourceConfig
+from ..metrics import source_import_seconds
+
+if TYPE_CHECKING:
+    from . import BaseSource
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SourceInfo:
+    name: str  # as shown in discord and sent by reporters
+    get_config: Callable[[Config], SourceConfig]  # its block of the config
+    # discord application the presence shows up as, None if accounts have to
+    # bring their own
+    client_id: str | None
+    activity_type: ActivityType = ActivityType.LISTENING
+    # (module, class) of the poller, imported on first use since the sdks behind
+    # them take a while to load. None for sources only reported over the api
+    poller: tuple[str, str] | None = None
+    update_gap: float = 1
+
+    def get_accounts(self, config: Config) -> list[AccountConfig]:
+        source_config = self.get_config(config)
+
+        if not isinstance(source_config, AccountConfig):
+            return []
+
+        return source_config.get_accounts()
+
+    def create_poller(self, config: Config, account: AccountConfig) -> "BaseSource":
+        return import_poller(self)(config, account, self.update_gap)
+
+
+# in priority order: when several sources play the same song, the first of these
+# wins. last.fm is last since it's usually just scrobbling one of the others
+SOURCES = (
+    SourceInfo(
+        "Spotify",
+        lambda config: config.spotify,
+        "1316777610419634180",
+        poller=(".spotify", "SpotifySource"),
+        update_gap=2,  # has progress info, no need to poll as often
+    ),
+    SourceInfo(
+        "Plex",
+        lambda config: config.plex,
+        "1316777729508642857",
+        poller=(".plex", "PlexSource"),
+    ),
+    SourceInfo(
+        "YouTube",
+        lambda config: config.youtube,
+        "1316777493889286206",
+        ActivityType.WATCHING,
+    ),
+    SourceInfo("SoundCloud", lambda config: config.soundcloud, "1316777669945458789"),
+    # whatever's playing locally, could be anything so there's no app for it
+    SourceInfo(
+        "MPRIS", lambda config: config.mpris, None, poller=(".mpris", "MprisSource")
+    ),
+    SourceInfo(
+        "Last.fm",
+        lambda config: config.lastfm,
+        "1316777803768664076",
+        poller=(".lastfm", "LastFmSource"),
+    ),
+)
+
+SOURCES_BY_NAME = {source.name: source for source in SOURCES}
+SOURCE_PRIORITIES = {source.name: index for index, source in enumerate(SOURCES)}
+
+POLLED_SOURCES = tuple(source for source in SOURCES if source.poller)
+API_SOURCES = tuple(source for source in SOURCES if not source.poller)
+
+
+@cache
+def import_poller(source: SourceInfo) -> type["BaseSource"]:
+    assert source.poller
+    module_name, class_name = source.poller
+
+    started = time.perf_counter()
+    module = importlib.import_module(module_name, __package__)
+    elapsed = time.perf_counter() - started
+
+    source_import_seconds.observe(elapsed, source=source.name)
+    logger.debug(f"Imported {source.name} source in {elapsed * 1000:.0f}ms")
+
+    return getattr(module, class_name)
@@ -1,14 +1,20 @@
 import logging
+import time
 
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 
-from . import BaseSource, Track
+from .. import CONFIG_DIR
+from ..config import SpotifyAccountConfig
+from ..http_client import get_session
+from . import BaseSource, Track, get_adaptive_gap
 
 logger = logging.getLogger(__name__)
 
 
 class SpotifySource(BaseSource):
+    account: SpotifyAccountConfig
+
     @property
     def source_name(self):
         return "Spotify"
@@ -18,37 +24,66 @@ class SpotifySource(BaseSource):
         return "https://storage.googleapis.com/pr-newsroom-wp/1/2023/05/Spotify_Primary_Logo_RGB_Green.png"
 
     def initialize_client(self):
+        self.client = None
+        self.idle_polls = 0
+
         if (
-            not self.config.spotify.client_id
-            or not self.config.spotify.client_secret
-            or not self.config.spotify.redirect_uri
+            not self.account.client_id
+            or not self.account.client_secret
+            or not self.account.redirect_uri
         ):
-            logger.debug("Spotify credentials not configured.")
+            logger.debug(f"{self.display_name} credentials not configured.")
             return
 
         try:
+            session = get_session()
+
             self.client = spotipy.Spotify(
                 auth_manager=SpotifyOAuth(
-                    client_id=self.config.spotify.client_id,
-                    client_secret=self.config.spotify.client_secret,
-                    redirect_uri=self.config.spotify.redirect_uri,
+                    client_id=self.account.client_id,
+                    client_secret=self.account.client_secret,
+                    redirect_uri=self.account.redirect_uri,
                     scope="user-read-currently-playing user-read-playback-state",
-                )
+                    # each account needs its own token
+                    cache_path=str(CONFIG_DIR / f"spotify-{self.account.name}.cache")
+                    if self.account.name
+                    else None,
+                    requests_session=session,
+                    requests_timeout=self.config.http.timeout_sec,
+                ),
+                requests_session=session,
+                requests_timeout=self.config.http.timeout_sec,
             )
         except Exception as e:
-            logger.warning(f"Failed to initialise {self.source_name}: {e}")
+            logger.warning(f"Failed to initialise {self.display_name}: {e}")
+
+    def get_update_gap(self, track: Track | None) -> float:
+        # progress is extrapolated locally, so only poll often enough to catch
+        # pauses, seeks and skips, and around the end of the track
+        return get_adaptive_gap(
+            self.update_gap,
+            self.account.max_update_gap,
+            track.get_remaining_sec() if track else None,
+            self.idle_polls,
+        )
 
     def get_current_track(self):
         if not self.client:
-            logger.debug("Spotify credentials not configured.")
+            logger.debug(f"{self.display_name} credentials not configured.")
             return None
 
         try:
+            request_time = time.time()
             current_track = self.client.current_playback()
+            # assume progress was sampled halfway through the round trip
+            progress_time = (request_time + time.time()) / 2
 
             if not current_track or not current_track["is_playing"]:
+                self.idle_polls += 1
                 return None
 
+            self.idle_polls = 0
+
             # Extract track information
             track = current_track["item"]
             return Track(
@@ -63,7 +98,8 @@ class SpotifySource(BaseSource):
                 ),
                 progress_ms=current_track["progress_ms"],
                 duration_ms=track["duration_ms"],
+                progress_time=progress_time,
             )
         except Exception as e:
-            logger.error(f"Error fetching Spotify track: {e}")
+            logger.error(f"Error fetching {self.display_name} track: {e}")
             return None
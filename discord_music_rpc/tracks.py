@@ -0,0 +1,246 @@
+import datetime
+import re
+import threading
+from collections.abc import Hashable
+from dataclasses import dataclass
+
+from .events import changes
+from .metrics import track_changes
+from .sources import SourceKey, Track, TrackWithSource, has_track_changed
+from .sources.registry import SOURCE_PRIORITIES, SOURCES
+
+DURATION_TOLERANCE_MS = 3000
+
+# bits services disagree on: "(feat. x)", "[Remastered]", " - 2011 Remaster", ...
+BRACKETS_PATTERN = re.compile(r"[(\[].*?[)\]]")
+SUFFIX_PATTERN = re.compile(r"\s+-\s+.*$|\s+(?:feat|ft)\.?\s.*$")
+PUNCTUATION_PATTERN = re.compile(r"[^\w]+")
+ARTIST_SEPARATOR_PATTERN = re.compile(r",|;|/|&|\s(?:feat|ft)\.?\s|\s(?:x|and|with)\s")
+
+
+@dataclass
+class TrackEntry:
+    track: TrackWithSource
+    expires: datetime.datetime | None  # None for tracks that stay until removed
+
+
+def is_same_entry(old: TrackWithSource | None, new: TrackWithSource | None) -> bool:
+    if old is None or new is None:
+        return old is new
+
+    return old.source_image == new.source_image and not has_track_changed(
+        old.track, new.track
+    )
+
+
+def normalize_title(title: str) -> str:
+    title = title.casefold()
+    stripped = SUFFIX_PATTERN.sub("", BRACKETS_PATTERN.sub("", title))
+    normalized = PUNCTUATION_PATTERN.sub(" ", stripped).strip()
+
+    # don't normalise a title away entirely, e.g. "(untitled)"
+    return normalized or PUNCTUATION_PATTERN.sub(" ", title).strip()
+
+
+def normalize_artists(artist: str) -> set[str]:
+    artist = BRACKETS_PATTERN.sub("", artist.casefold())
+
+    return {
+        normalized
+        for name in ARTIST_SEPARATOR_PATTERN.split(artist)
+        if (normalized := PUNCTUATION_PATTERN.sub(" ", name).strip())
+    }
+
+
+def is_same_song(track1: Track, track2: Track) -> bool:
+    """
+    Loosely compares songs from different services, which format titles and
+    artists differently.
+    """
+    if normalize_title(track1.name) != normalize_title(track2.name):
+        return False
+
+    # spotify lists every artist, last.fm only the main one
+    if not normalize_artists(track1.artist) & normalize_artists(track2.artist):
+        return False
+
+    if track1.duration_ms and track2.duration_ms:
+        return abs(track1.duration_ms - track2.duration_ms) <= DURATION_TOLERANCE_MS
+
+    return True
+
+
+def get_priority(track: TrackWithSource) -> tuple[int, float]:
+    """
+    Sort key, lower is better: source priority first, then whichever was
+    sampled most recently.
+    """
+    priority = SOURCE_PRIORITIES.get(track.source, len(SOURCES))
+
+    return priority, -(track.track.progress_time or 0)
+
+
+def arbitrate(
+    tracks: dict[SourceKey, TrackWithSource],
+) -> dict[SourceKey, TrackWithSource]:
+    """
+    Drops tracks that are the same song as a better one for the same account, so
+    only one presence shows it.
+    """
+    kept: dict[SourceKey, TrackWithSource] = {}
+
+    for key, track in sorted(tracks.items(), key=lambda item: get_priority(item[1])):
+        if any(
+            other.account == track.account and is_same_song(other.track, track.track)
+            for other in kept.values()
+        ):
+            continue
+
+        kept[key] = track
+
+    return kept
+
+
+class TrackRegistry:
+    """
+    Current track for each (source, account), written to by anything that produces
+    tracks (the api, the source manager) as they come in. Several producers can
+    report the same key, the first one to do so wins until it goes away.
+
+    `version` only moves when the best track for some key actually changes, so
+    consumers can skip everything if it's the same as last time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.producers: dict[Hashable, SourceKey] = {}
+        self.entries: dict[SourceKey, dict[Hashable, TrackEntry]] = {}
+        self.best: dict[SourceKey, TrackWithSource] = {}
+
+    def put(
+        self,
+        producer: Hashable,
+        track: TrackWithSource | None,
+        ttl_sec: float | None = None,
+    ):
+        """
+        Set (or with None, remove) `producer`'s current track. With `ttl_sec` the
+        track is dropped if it isn't set again within that long.
+        """
+        with self.lock:
+            keys = set()
+
+            # replacing a track under the same key keeps the producer's place
+            old_key = self.producers.get(producer)
+            if old_key is not None and (not track or track.key != old_key):
+                del self.producers[producer]
+                del self.entries[old_key][producer]
+                keys.add(old_key)
+
+            if track:
+                expires = None
+                if ttl_sec is not None:
+                    expires = datetime.datetime.now() + datetime.timedelta(
+                        seconds=ttl_sec
+                    )
+
+                self.producers[producer] = track.key
+                self.entries.setdefault(track.key, {})[producer] = TrackEntry(
+                    track, expires
+                )
+                keys.add(track.key)
+
+            changed = self.refresh(keys)
+
+        if changed:
+            changes.notify()
+
+    def touch(self, producer: Hashable, ttl_sec: float):
+        """
+        Push back when `producer`'s track expires, for producers that resend the
+        same track to say it's still playing.
+        """
+        with self.lock:
+            key = self.producers.get(producer)
+            if key is None:
+                return
+
+            entry = self.entries[key][producer]
+            if entry.expires:
+                entry.expires = datetime.datetime.now() + datetime.timedelta(
+                    seconds=ttl_sec
+                )
+
+    def refresh(self, keys: set[SourceKey]) -> bool:
+        changed = False
+
+        for key in keys:
+            entries = self.entries.get(key)
+            best = next(iter(entries.values())).track if entries else None
+
+            if not entries:
+                self.entries.pop(key, None)
+
+            if not is_same_entry(self.best.get(key), best):
+                changed = True
+                track_changes.inc(source=key[0], account=key[1] or "")
+
+            # keep the newest copy even if it's the same track, it has the latest
+            # progress
+            if best:
+                self.best[key] = best
+            else:
+                self.best.pop(key, None)
+
+        if changed:
+            self.version += 1
+
+        return changed
+
+    def expire(self):
+        """
+        Drop tracks whose producers stopped refreshing them. Meant to be called by
+        the consumer right before reading, so it only bumps the version.
+        """
+        now = datetime.datetime.now()
+
+        with self.lock:
+            expired = [
+                (key, producer)
+                for key, entries in self.entries.items()
+                for producer, entry in entries.items()
+                if entry.expires and entry.expires <= now
+            ]
+
+            for key, producer in expired:
+                del self.entries[key][producer]
+                del self.producers[producer]
+
+            self.refresh({key for key, _producer in expired})
+
+    def get_tracks(self) -> tuple[int, dict[SourceKey, TrackWithSource]]:
+        """
+        The current version along with the best track for each key.
+        """
+        with self.lock:
+            return self.version, dict(self.best)
+
+    def get_next_deadline(self) -> datetime.datetime | None:
+        """
+        Earliest time one of the current tracks expires, the main loop has to
+        wake up then even if nothing else happens.
+        """
+        with self.lock:
+            return min(
+                (
+                    entry.expires
+                    for entries in self.entries.values()
+                    for entry in entries.values()
+                    if entry.expires
+                ),
+                default=None,
+            )
+
+
+track_registry = TrackRegistry()
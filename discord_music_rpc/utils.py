@@ -1,25 +1,82 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
 import yaml
 
-from .sources import TrackWithSource
 
+class PrettyDumper(yaml.Dumper):
+    def increase_indent(self, flow=False, indentless=False):
+        return super().increase_indent(flow, False)
+
+
+class RateLimiter:
+    """
+    Allows at most `limit` actions in any `period_sec` long window.
+    """
 
-def is_same_track(
-    track1: TrackWithSource | None, track2: TrackWithSource | None
-) -> bool:
-    if not track1 and not track2:
+    def __init__(self, limit: int, period_sec: float):
+        self.limit = limit
+        self.period_sec = period_sec
+        self.times: deque[float] = deque()
+
+    def expire(self, now: float):
+        while self.times and self.times[0] <= now - self.period_sec:
+            self.times.popleft()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self.expire(now)
+
+        if len(self.times) >= self.limit:
+            return False
+
+        self.times.append(now)
         return True
 
-    if not track1 or not track2:
-        return False
+    def time_until_available(self) -> float:
+        now = time.monotonic()
+        self.expire(now)
 
-    return (
-        track1.track.name == track2.track.name
-        and track1.track.artist == track2.track.artist
-        and track1.track.album == track2.track.album
-        and track1.source == track2.source
-    )
+        if len(self.times) < self.limit:
+            return 0.0
 
+        return self.times[0] + self.period_sec - now
 
-class PrettyDumper(yaml.Dumper):
-    def increase_indent(self, flow=False, indentless=False):
-        return super().increase_indent(flow, False)
+
+class TtlLruCache[K, V]:
+    """
+    Thread-safe cache holding at most `max_entries`, evicting the least recently
+    used first. Entries expire `ttl_sec` after they were put.
+    """
+
+    def __init__(self, max_entries: int, ttl_sec: float):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[K, tuple[V, float]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl_sec)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,106 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+POLL_GAP = 2
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class FileWatcher:
+    """
+    Calls `on_change` from a background thread whenever `path` might have
+    changed. Uses inotify on Linux and falls back to polling the file's mtime/size
+    everywhere else, so callers should still check whether the content changed.
+    """
+
+    def __init__(self, path: Path, on_change: Callable[[], None]):
+        self.path = path
+        self.on_change = on_change
+        self.thread: threading.Thread | None = None
+
+    def start(self):
+        if self.thread:
+            return
+
+        target: Callable[..., None] = self.poll_loop
+        args: tuple = ()
+
+        if sys.platform.startswith("linux"):
+            try:
+                args = (self.init_inotify(),)
+                target = self.inotify_loop
+            except OSError as e:
+                logger.debug(f"inotify unavailable, polling {self.path} instead: {e}")
+
+        self.thread = threading.Thread(target=target, args=args, daemon=True)
+        self.thread.start()
+
+    def init_inotify(self) -> int:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # watch the directory rather than the file so editors that save by
+        # replacing the file don't drop the watch
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(self.path.parent), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+        return fd
+
+    def inotify_loop(self, fd: int):
+        name = os.fsencode(self.path.name)
+
+        while True:
+            data = os.read(fd, 4096)
+
+            offset = 0
+            changed = False
+            while offset < len(data):
+                _wd, _mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                changed |= data[offset : offset + length].rstrip(b"\0") == name
+                offset += length
+
+            if changed:
+                self.on_change()
+
+    def get_signature(self) -> tuple[int, int] | None:
+        try:
+            stat = self.path.stat()
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def poll_loop(self):
+        signature = self.get_signature()
+
+        while True:
+            time.sleep(POLL_GAP)
+
+            new_signature = self.get_signature()
+            if new_signature != signature:
+                signature = new_signature
+                self.on_change()
@@ -2,7 +2,7 @@
 // @name        discord-music-rpc helper
 // @namespace   https://github.com/f0e
 // @author      f0e
-// @version     1.03
+// @version     1.05
 // @match       *://*.soundcloud.com/*
 // @match       *://*.youtube.com/*
 // @grant       none
@@ -14,8 +14,14 @@
 // lots of code from https://github.com/web-scrobbler/web-scrobbler
 
 const WEBSOCKET_URL = "ws://localhost:47474"; // note: brave shields block local websockets.. -_-
-const VERSION = 1;
+const VERSION = 2;
+
+// defaults until the server tells us what it wants
 const UPDATE_GAP_SECS = 1;
+const HEARTBEAT_SECS = 30;
+
+// progress further than this from where it should be is a seek
+const SEEK_TOLERANCE_MS = 3000;
 
 const PLATFORM_LOGOS = {
   SoundCloud:
@@ -25,6 +31,21 @@ const PLATFORM_LOGOS = {
 
 const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
 
+// whether trackInfo is worth sending, progress moving along with the clock isn't
+const hasTrackChanged = (oldInfo, newInfo, elapsedMs) => {
+  if (!oldInfo || !newInfo) return oldInfo !== newInfo;
+
+  const { progress_ms: oldProgress, ...oldRest } = oldInfo;
+  const { progress_ms: newProgress, ...newRest } = newInfo;
+
+  if (JSON.stringify(oldRest) !== JSON.stringify(newRest)) return true;
+
+  // players without a progress bar report 0 for both, that isn't a seek
+  if (!newProgress || !newInfo.duration_ms) return false;
+
+  return Math.abs(newProgress - (oldProgress + elapsedMs)) > SEEK_TOLERANCE_MS;
+};
+
 const getTextFromSelectors = (selectors) => {
   for (const selector of selectors) {
     const element = document.querySelector(selector);
@@ -273,6 +294,22 @@ class ApiConnector {
     this.socket = null;
     this.reconnectTimeout = null;
     this.isConnected = false;
+
+    // sent by the server on connect and whenever its config changes
+    this.config = null;
+    this.needsResend = false;
+  }
+
+  isSourceEnabled(source) {
+    return this.config?.sources?.[source] ?? true;
+  }
+
+  getUpdateGapSecs() {
+    return this.config?.min_update_gap_sec ?? UPDATE_GAP_SECS;
+  }
+
+  getHeartbeatSecs() {
+    return this.config?.heartbeat_sec ?? HEARTBEAT_SECS;
   }
 
   connect() {
@@ -281,9 +318,24 @@ class ApiConnector {
     this.socket.onopen = () => {
       console.log("WebSocket connected");
       this.isConnected = true;
+      this.needsResend = true;
       clearTimeout(this.reconnectTimeout);
     };
 
+    this.socket.onmessage = (event) => {
+      try {
+        const packet = JSON.parse(event.data);
+
+        if (packet.type === "config") {
+          console.log("Received config", packet);
+          this.config = packet;
+          this.needsResend = true; // a source might've just been enabled
+        }
+      } catch (error) {
+        console.error("Error handling message", error);
+      }
+    };
+
     this.socket.onclose = (event) => {
       console.log("WebSocket disconnected", event);
       this.isConnected = false;
@@ -296,7 +348,10 @@ class ApiConnector {
   }
 
   sendTrackInfo(trackInfo, sourceInfo) {
-    if (!this.isConnected) return;
+    if (!this.isConnected) return false;
+
+    // server doesn't want it
+    if (!this.isSourceEnabled(sourceInfo.source)) return true;
 
     try {
       const packet = {
@@ -310,8 +365,10 @@ class ApiConnector {
       console.log("Sent track info", packet);
 
       this.socket.send(JSON.stringify(packet));
+      return true;
     } catch (error) {
       console.error("Error sending track info", error);
+      return false;
     }
   }
 
@@ -338,16 +395,29 @@ async function run() {
   const connector = new PlatformConnectorClass();
   let first = true;
   let lastTrackInfo = null;
+  let lastSentAt = 0;
 
   while (true) {
-    if (!first) await sleep(UPDATE_GAP_SECS * 1000);
+    if (!first) await sleep(scrobbler.getUpdateGapSecs() * 1000);
     else first = false;
 
     const trackInfo = connector.getTrackInfo();
-
-    if (JSON.stringify(lastTrackInfo) !== JSON.stringify(trackInfo)) {
-      scrobbler.sendTrackInfo(trackInfo, connector.getSourceInfo());
+    const now = Date.now();
+
+    // the server works progress out from the last update, so only send when
+    // something changes, plus a heartbeat so it knows we're still here
+    const shouldSend =
+      scrobbler.needsResend ||
+      hasTrackChanged(lastTrackInfo, trackInfo, now - lastSentAt) ||
+      (trackInfo && now - lastSentAt >= scrobbler.getHeartbeatSecs() * 1000);
+
+    if (
+      shouldSend &&
+      scrobbler.sendTrackInfo(trackInfo, connector.getSourceInfo())
+    ) {
       lastTrackInfo = trackInfo;
+      lastSentAt = now;
+      scrobbler.needsResend = false;
     }
   }
 }
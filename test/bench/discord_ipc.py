@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import struct
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from pathlib import Path
+
+HEADER = struct.Struct("<II")  # opcode, payload length
+
+OP_HANDSHAKE = 0
+OP_FRAME = 1
+OP_CLOSE = 2
+
+# what the real client enforces, anything over this is rejected
+UPDATE_LIMIT = 5
+UPDATE_LIMIT_PERIOD_SEC = 20
+
+
+@dataclass
+class Frame:
+    time: float
+    client_id: str
+    details: str | None  # None for clears
+    rejected: bool  # over the rate limit, never shown
+
+
+class FakeDiscord:
+    """
+    Discord's IPC socket, recording every SET_ACTIVITY it gets. Ones over the
+    rate limit are rejected with an error like the real client does, so they
+    never show up.
+    """
+
+    def __init__(self, runtime_dir: Path, pipe: int = 0):
+        self.path = runtime_dir / f"discord-ipc-{pipe}"
+        self.frames: list[Frame] = []
+        self.handshakes = 0
+        self.recent: dict[str, deque[float]] = defaultdict(deque)
+
+    async def start(self):
+        if self.path.exists():
+            os.unlink(self.path)
+
+        await asyncio.start_unix_server(self.handle_connection, self.path)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client_id = ""
+
+        try:
+            while True:
+                op, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = json.loads(await reader.readexactly(length))
+
+                if op == OP_HANDSHAKE:
+                    client_id = payload["client_id"]
+                    self.handshakes += 1
+                    self.send(writer, OP_FRAME, self.get_ready())
+                elif op == OP_FRAME:
+                    if self.record(client_id, payload):
+                        self.send(writer, OP_FRAME, self.get_reply(payload))
+                    else:
+                        self.send(writer, OP_FRAME, self.get_error(payload))
+                elif op == OP_CLOSE:
+                    break
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # pypresence probes the socket by connecting and hanging up
+        finally:
+            writer.close()
+
+    def record(self, client_id: str, payload) -> bool:
+        """
+        Returns whether the frame was within the rate limit and so applied.
+        """
+        activity = payload.get("args", {}).get("activity")
+        now = time.time()
+
+        recent = self.recent[client_id]
+        while recent and recent[0] <= now - UPDATE_LIMIT_PERIOD_SEC:
+            recent.popleft()
+
+        rejected = len(recent) >= UPDATE_LIMIT
+        if not rejected:
+            recent.append(now)
+
+        details = activity.get("details") if activity else None
+        self.frames.append(Frame(now, client_id, details, rejected))
+
+        return not rejected
+
+    def get_ready(self):
+        return {
+            "cmd": "DISPATCH",
+            "evt": "READY",
+            "data": {"v": 1, "user": {"id": "1", "username": "bench"}},
+        }
+
+    def get_reply(self, payload):
+        return {
+            "cmd": payload.get("cmd"),
+            "evt": None,
+            "nonce": payload.get("nonce"),
+            "data": payload.get("args", {}).get("activity"),
+        }
+
+    def get_error(self, payload):
+        return {
+            "cmd": payload.get("cmd"),
+            "evt": "ERROR",
+            "nonce": payload.get("nonce"),
+            "data": {"code": 1000, "message": "You are being rate limited."},
+        }
+
+    def send(self, writer: asyncio.StreamWriter, op: int, data):
+        body = json.dumps(data).encode()
+        writer.write(HEADER.pack(op, len(body)) + body)
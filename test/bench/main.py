@@ -0,0 +1,438 @@
+"""
+Runs the app against fake upstreams, a fake Discord and a crowd of userscript
+tabs, then reports how quickly track changes reach Discord and what it cost.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .upstreams import PLEX_LIBRARY, PLEX_TOKEN
+from .world import WorldConfig, run_world
+
+SERVICES = ("Spotify", "Last.fm", "Plex", "YouTube")
+
+# local players don't have a discord application of their own
+MPRIS_CLIENT_ID = "bench-mpris"
+
+WARMUP_TIMEOUT_SEC = 30
+STOP_TIMEOUT_SEC = 10
+SETTLE_SEC = 15  # no changes this close to the end, so the last ones can land
+
+SPOTIFY_SCOPE = "user-read-currently-playing user-read-playback-state"
+
+
+@dataclass
+class Change:
+    service: str
+    name: str
+    time: float
+
+
+@dataclass
+class Sample:
+    time: float
+    rss_bytes: int
+    objects: int
+
+
+@dataclass
+class Run:
+    changes: list[Change] = field(default_factory=list)
+    samples: list[Sample] = field(default_factory=list)
+    cpu_sec: float = 0
+    wall_sec: float = 0
+    ticks: float = 0
+    throttled: float = 0  # updates the app held back for the rate limit
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak rather than current, but still shows growth
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def take_sample() -> Sample:
+    return Sample(time.time(), get_rss_bytes(), len(gc.get_objects()))
+
+
+def prepare_environment(root: Path):
+    """
+    Point the app's config, the Discord socket and the Spotify token cache at
+    `root`. Has to happen before the app is imported, it reads these on import.
+    """
+    config_home = root / "config"
+    runtime_dir = root / "run"
+    config_home.mkdir()
+    runtime_dir.mkdir()
+
+    os.environ["XDG_CONFIG_HOME"] = str(config_home)
+    os.environ["XDG_RUNTIME_DIR"] = str(runtime_dir)
+    os.environ["PYSTRAY_BACKEND"] = "dummy"
+    os.environ["NO_PROXY"] = "127.0.0.1,localhost"
+
+    # spotipy looks for its token in the working directory
+    os.chdir(root)
+    token = {
+        "access_token": "bench",
+        "token_type": "Bearer",
+        "expires_in": 3600,
+        "expires_at": int(time.time()) + 24 * 60 * 60,
+        "refresh_token": "bench",
+        "scope": SPOTIFY_SCOPE,
+    }
+    (root / ".cache").write_text(json.dumps(token))
+
+
+def write_config(root: Path, world: WorldConfig, api_port: int):
+    config = {
+        "api": {"port": api_port},
+        "spotify": {"enabled": True, "client_id": "bench", "client_secret": "bench"},
+        "lastfm": {"enabled": True, "username": "bench", "api_key": "bench"},
+        "plex": {
+            "enabled": True,
+            "server_url": f"http://127.0.0.1:{world.plex_port}",
+            "token": PLEX_TOKEN,
+            "libraries": [PLEX_LIBRARY],
+        },
+        "youtube": {"enabled": True},
+        "mpris": {"enabled": world.mpris, "discord_client_id": MPRIS_CLIENT_ID},
+    }
+
+    config_dir = root / "config" / "discord-music-rpc"
+    config_dir.mkdir(exist_ok=True)
+    # json is valid yaml
+    (config_dir / "config.yaml").write_text(json.dumps(config, indent=2))
+
+
+def patch_upstreams(world: WorldConfig):
+    import spotipy
+
+    from discord_music_rpc.meta_sources import lastfm as lastfm_meta
+    from discord_music_rpc.sources import lastfm
+
+    lastfm_url = f"http://127.0.0.1:{world.lastfm_port}/2.0/"
+    lastfm.API_URL = lastfm_url
+    lastfm_meta.BASE_URL = lastfm_url
+
+    spotify_init = spotipy.Spotify.__init__
+
+    def init(self, *args, **kwargs):
+        spotify_init(self, *args, **kwargs)
+        self.prefix = f"http://127.0.0.1:{world.spotify_port}/v1/"
+
+    spotipy.Spotify.__init__ = init
+
+
+def get_ticks() -> float:
+    from discord_music_rpc.metrics import main_loop_ticks
+
+    return sum(main_loop_ticks.values.values())
+
+
+def get_throttled() -> float:
+    from discord_music_rpc.metrics import discord_throttled
+
+    return sum(discord_throttled.values.values())
+
+
+def get_client_id(service: str) -> str:
+    from discord_music_rpc.sources.registry import SOURCES_BY_NAME
+
+    return SOURCES_BY_NAME[service].client_id or MPRIS_CLIENT_ID
+
+
+def get_seen_clients(conn) -> set[str]:
+    conn.send(("report",))
+    return {client_id for _time, client_id, *_ in conn.recv()["frames"]}
+
+
+def run_scenario(args, conn, services: tuple[str, ...]) -> tuple[Run, dict, dict]:
+    # let every source connect and show its first track before measuring
+    deadline = time.time() + WARMUP_TIMEOUT_SEC
+    while time.time() < deadline:
+        if get_seen_clients(conn) >= {get_client_id(service) for service in services}:
+            break
+        time.sleep(0.5)
+    else:
+        print("warning: not every source reached discord during warmup")
+
+    conn.send(("report",))
+    before = conn.recv()
+
+    run = Run()
+    started = time.time()
+    cpu_started = time.process_time()
+    ticks_started = get_ticks()
+    throttled_started = get_throttled()
+    next_change = started + args.change_every
+    next_sample = started
+    change_count = 0
+
+    while (now := time.time()) < started + args.duration:
+        if now >= next_sample:
+            run.samples.append(take_sample())
+            next_sample += args.sample_every
+
+        if now >= next_change and now < started + args.duration - SETTLE_SEC:
+            service = services[change_count % len(services)]
+            conn.send(("change", service))
+            name, changed_at = conn.recv()
+            run.changes.append(Change(service, name, changed_at))
+            change_count += 1
+            next_change += args.change_every
+
+        wake = min(next_sample, next_change, started + args.duration)
+        time.sleep(max(wake - time.time(), 0))
+
+    run.samples.append(take_sample())
+    run.cpu_sec = time.process_time() - cpu_started
+    run.wall_sec = time.time() - started
+    run.ticks = get_ticks() - ticks_started
+    run.throttled = get_throttled() - throttled_started
+
+    conn.send(("report",))
+    after = conn.recv()
+
+    return run, before, after
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarise(run: Run, before: dict, after: dict, services: tuple[str, ...]) -> dict:
+    started = run.samples[0].time
+    frames = [frame for frame in after["frames"] if frame[0] >= started]
+
+    latencies: dict[str, list[float]] = {service: [] for service in services}
+    missed: dict[str, int] = dict.fromkeys(services, 0)
+
+    for change in run.changes:
+        client_id = get_client_id(change.service)
+        shown = next(
+            (
+                frame_time
+                for frame_time, frame_client_id, details, rejected in frames
+                if frame_client_id == client_id
+                and details
+                and details.strip() == change.name
+                and frame_time >= change.time
+                and not rejected
+            ),
+            None,
+        )
+
+        if shown is None:
+            missed[change.service] += 1
+        else:
+            latencies[change.service].append(shown - change.time)
+
+    minutes = run.wall_sec / 60
+    requests = {
+        service: {
+            endpoint: (count - before["requests"][service].get(endpoint, 0)) / minutes
+            for endpoint, count in after["requests"][service].items()
+            if count > before["requests"][service].get(endpoint, 0)
+        }
+        for service in services
+    }
+
+    first, last = run.samples[0], run.samples[-1]
+    hours = max(last.time - first.time, 1) / 60 / 60
+
+    return {
+        "duration_sec": run.wall_sec,
+        "latency_sec": {
+            service: {
+                "changes": len(values) + missed[service],
+                "missed": missed[service],
+                "p50": percentile(values, 0.5) if values else None,
+                "p95": percentile(values, 0.95) if values else None,
+                "max": max(values, default=None),
+            }
+            for service, values in latencies.items()
+        },
+        "requests_per_min": requests,
+        "discord": {
+            "frames": len(frames),
+            "rejected": sum(1 for frame in frames if frame[3]),
+            "held_back": run.throttled,
+            "handshakes": after["handshakes"] - before["handshakes"],
+        },
+        "cpu": {
+            "total_sec": run.cpu_sec,
+            "percent": run.cpu_sec / run.wall_sec * 100,
+            "ticks": run.ticks,
+            "ms_per_tick": run.cpu_sec / run.ticks * 1000 if run.ticks else None,
+        },
+        "memory": {
+            "rss_start_mib": first.rss_bytes / 2**20,
+            "rss_end_mib": last.rss_bytes / 2**20,
+            "rss_growth_mib_per_hour": (last.rss_bytes - first.rss_bytes)
+            / 2**20
+            / hours,
+            "objects_start": first.objects,
+            "objects_end": last.objects,
+        },
+    }
+
+
+def format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def print_report(report: dict):
+    print(f"\nran for {report['duration_sec']:.0f}s\n")
+
+    print("track change -> discord")
+    for service, latency in report["latency_sec"].items():
+        print(
+            f"  {service:<8} {latency['changes']:>3} changes, "
+            f"{latency['missed']} missed, p50 {format_seconds(latency['p50'])}, "
+            f"p95 {format_seconds(latency['p95'])}, max {format_seconds(latency['max'])}"
+        )
+
+    print("\nupstream requests per minute")
+    for service, endpoints in report["requests_per_min"].items():
+        total = sum(endpoints.values())
+        detail = ", ".join(f"{key} {value:.1f}" for key, value in endpoints.items())
+        print(f"  {service:<8} {total:>6.1f}  ({detail})")
+
+    discord = report["discord"]
+    print(
+        f"\ndiscord: {discord['frames']} frames, {discord['rejected']} rejected for "
+        f"the rate limit, {discord['held_back']} held back by the app, "
+        f"{discord['handshakes']} handshakes"
+    )
+
+    cpu = report["cpu"]
+    ms_per_tick = cpu["ms_per_tick"]
+    print(
+        f"cpu: {cpu['total_sec']:.2f}s ({cpu['percent']:.1f}%), {cpu['ticks']:.0f} "
+        f"ticks, {'-' if ms_per_tick is None else f'{ms_per_tick:.2f}ms'} per tick"
+    )
+
+    memory = report["memory"]
+    print(
+        f"memory: rss {memory['rss_start_mib']:.1f} -> {memory['rss_end_mib']:.1f} "
+        f"MiB ({memory['rss_growth_mib_per_hour']:+.1f} MiB/h), objects "
+        f"{memory['objects_start']} -> {memory['objects_end']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=300, help="seconds")
+    parser.add_argument(
+        "--change-every", type=float, default=15, help="seconds between track changes"
+    )
+    parser.add_argument("--tabs", type=int, default=10, help="userscript tabs")
+    parser.add_argument(
+        "--tab-version",
+        type=int,
+        default=2,
+        help="protocol the tabs speak, 1 sends every second",
+    )
+    parser.add_argument(
+        "--sample-every", type=float, default=10, help="seconds between memory samples"
+    )
+    parser.add_argument(
+        "--mpris",
+        action="store_true",
+        help="also play on a local player, needs a session bus (dbus-run-session)",
+    )
+    parser.add_argument("--json", type=Path, help="also write the report here")
+    parser.add_argument("--verbose", action="store_true", help="show the app's log")
+    args = parser.parse_args()
+
+    if args.mpris and "DBUS_SESSION_BUS_ADDRESS" not in os.environ:
+        parser.error("--mpris needs a session bus, try dbus-run-session")
+
+    services = (*SERVICES, "MPRIS") if args.mpris else SERVICES
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="dmr-bench-") as tmp:
+        root = Path(tmp)
+        prepare_environment(root)
+
+        api_port = get_free_port()
+        world = WorldConfig(
+            runtime_dir=root / "run",
+            spotify_port=get_free_port(),
+            lastfm_port=get_free_port(),
+            plex_port=get_free_port(),
+            api_url=f"ws://127.0.0.1:{api_port}",
+            tabs=args.tabs,
+            tab_version=args.tab_version,
+            mpris=args.mpris,
+        )
+        write_config(root, world, api_port)
+
+        # spawn so the fakes don't inherit anything from this process
+        conn, world_conn = multiprocessing.Pipe()
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_world, args=(world, world_conn), daemon=True
+        )
+        process.start()
+        conn.recv()  # ready
+
+        from discord_music_rpc import killer, setup_logging
+        from discord_music_rpc import main as app
+        from discord_music_rpc.meta_sources.cache import cover_art_cache
+
+        # without it only warnings and errors get through
+        if args.verbose:
+            setup_logging()
+
+        patch_upstreams(world)
+        app.run_tray_icon = lambda: None  # nothing to show it on
+
+        tracker = app.MusicTracker()
+        thread = threading.Thread(target=tracker.run, daemon=True)
+        thread.start()
+
+        try:
+            run, before, after = run_scenario(args, conn, services)
+        finally:
+            killer.exit_gracefully()
+            thread.join(STOP_TIMEOUT_SEC)
+
+            # while the temp dir is still there
+            cover_art_cache.flush()
+
+            conn.send(("stop",))
+            process.join(STOP_TIMEOUT_SEC)
+
+            os.chdir(cwd)
+
+    report = summarise(run, before, after, services)
+    print_report(report)
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import asyncio
+
+from jeepney import (
+    DBusAddress,
+    HeaderFields,
+    MatchRule,
+    Message,
+    message_bus,
+    new_error,
+    new_method_return,
+    new_signal,
+)
+from jeepney.io.asyncio import DBusRouter, open_dbus_router
+
+from .upstreams import TRACK_DURATION_MS, Playback
+
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+
+class FakeMprisPlayer:
+    """
+    A player on the session bus that answers property reads and signals track
+    changes, like mpv or vlc would.
+    """
+
+    def __init__(self, playback: Playback, name: str = "bench"):
+        self.bus_name = f"org.mpris.MediaPlayer2.{name}"
+        self.playback = playback
+        self.requests = {"Get": 0, "GetAll": 0}
+        self.router: DBusRouter | None = None
+        self.ready = asyncio.Event()
+
+    async def run(self):
+        async with open_dbus_router(bus="SESSION") as router:
+            self.router = router
+
+            with router.filter(
+                MatchRule(type="method_call", path=MPRIS_PATH), bufsize=64
+            ) as queue:
+                await router.send_and_get_reply(message_bus.RequestName(self.bus_name))
+                self.ready.set()
+
+                while True:
+                    await router.send(self.handle_call(await queue.get()))
+
+    def get_properties(self) -> dict:
+        return {
+            "PlaybackStatus": ("s", "Playing"),
+            "Metadata": ("a{sv}", self.get_metadata()),
+            "Position": ("x", self.playback.progress_ms * 1000),
+            "Rate": ("d", 1.0),
+        }
+
+    def get_metadata(self) -> dict:
+        return {
+            "mpris:trackid": ("o", f"/bench/track/{self.playback.number}"),
+            "mpris:length": ("x", TRACK_DURATION_MS * 1000),
+            "xesam:title": ("s", self.playback.name),
+            "xesam:artist": ("as", [self.playback.artist]),
+            "xesam:album": ("s", self.playback.album),
+        }
+
+    def handle_call(self, message: Message) -> Message:
+        member = message.header.fields.get(HeaderFields.member)
+        properties = self.get_properties()
+
+        if member in self.requests:
+            self.requests[member] += 1
+
+        if member == "GetAll":
+            return new_method_return(message, "a{sv}", (properties,))
+
+        if member == "Get" and message.body[1] in properties:
+            return new_method_return(message, "v", (properties[message.body[1]],))
+
+        return new_error(message, "org.freedesktop.DBus.Error.UnknownMethod")
+
+    async def notify(self):
+        """
+        Tell listeners the track changed.
+        """
+        if not self.router:
+            return
+
+        emitter = DBusAddress(MPRIS_PATH, interface=PROPERTIES_INTERFACE)
+        changed = {"Metadata": ("a{sv}", self.get_metadata())}
+        await self.router.send(
+            new_signal(
+                emitter,
+                "PropertiesChanged",
+                "sa{sv}as",
+                (PLAYER_INTERFACE, changed, []),
+            )
+        )
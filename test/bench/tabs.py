@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+
+from .upstreams import TRACK_DURATION_MS, Playback
+
+YOUTUBE_IMAGE = "https://www.youtube.com/s/desktop/favicon.ico"
+
+RECONNECT_GAP_SEC = 1
+
+
+class Tab:
+    """
+    One browser tab running the userscript. Protocol 2 tabs send on change and
+    heartbeat like the current script, protocol 1 tabs send every tick like old
+    ones did.
+    """
+
+    def __init__(self, url: str, playback: Playback, version: int):
+        self.url = url
+        self.playback = playback
+        self.version = version
+        self.sent = 0
+        self.websocket: ClientConnection | None = None
+
+        # until the server says otherwise
+        self.update_gap_sec = 1.0
+        self.heartbeat_sec = 30.0
+        self.enabled = True
+
+    async def run(self):
+        while True:
+            try:
+                async with connect(self.url) as websocket:
+                    self.websocket = websocket
+                    await asyncio.gather(
+                        self.read_config(websocket), self.send_tracks(websocket)
+                    )
+            except (OSError, ConnectionClosed):
+                pass  # app isn't up yet, or restarted the server
+
+            await asyncio.sleep(RECONNECT_GAP_SEC)
+
+    async def close(self):
+        if self.websocket:
+            await self.websocket.close()
+
+    async def read_config(self, websocket: ClientConnection):
+        async for message in websocket:
+            config = json.loads(message)
+            if config.get("type") != "config":
+                continue
+
+            self.enabled = config["sources"].get("YouTube", True)
+            self.update_gap_sec = config["min_update_gap_sec"]
+            self.heartbeat_sec = config["heartbeat_sec"]
+
+    async def send_tracks(self, websocket: ClientConnection):
+        sent_name = None
+        sent_at = 0.0
+
+        while True:
+            now = time.time()
+
+            if self.enabled and (
+                self.version < 2
+                or self.playback.name != sent_name
+                or now - sent_at >= self.heartbeat_sec
+            ):
+                await websocket.send(json.dumps(self.get_message()))
+                self.sent += 1
+                sent_name = self.playback.name
+                sent_at = now
+
+            await asyncio.sleep(self.update_gap_sec)
+
+    def get_message(self):
+        return {
+            "version": self.version,
+            "type": "track_update",
+            "data": {
+                "name": self.playback.name,
+                "artist": self.playback.artist,
+                "album": None,
+                "url": "https://www.youtube.com/watch?v=bench",
+                "image": None,
+                "progress_ms": self.playback.progress_ms,
+                "duration_ms": TRACK_DURATION_MS,
+            },
+            "source": "YouTube",
+            "source_image": YOUTUBE_IMAGE,
+        }
@@ -0,0 +1,268 @@
+import json
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import quoteattr
+
+from websockets.asyncio.server import ServerConnection, broadcast, serve
+from websockets.http11 import Request
+
+TRACK_DURATION_MS = 180_000
+
+PLEX_TOKEN = "bench-token"
+PLEX_LIBRARY = "Music"
+PLEX_NOTIFICATIONS_PATH = "/:/websockets/notifications"
+PLEX_TRACK_KEY_OFFSET = 1000  # rating keys of tracks, artist/album keys sit below
+
+
+@dataclass
+class Playback:
+    """
+    What's "playing" on one fake service. Each service gets its own track names so
+    the app doesn't merge them into one presence.
+    """
+
+    service: str
+    number: int = 0
+    changed_at: float = field(default_factory=time.time)
+
+    @property
+    def name(self) -> str:
+        return f"{self.service} track {self.number}"
+
+    @property
+    def artist(self) -> str:
+        return f"{self.service} artist"
+
+    @property
+    def album(self) -> str:
+        return f"{self.service} album"
+
+    @property
+    def progress_ms(self) -> int:
+        return min(int((time.time() - self.changed_at) * 1000), TRACK_DURATION_MS)
+
+    def change(self) -> tuple[str, float]:
+        self.number += 1
+        self.changed_at = time.time()
+        return self.name, self.changed_at
+
+
+class FakeHttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, handler: type[BaseHTTPRequestHandler], playback):
+        super().__init__(("127.0.0.1", port), handler)
+        self.playback = playback
+        self.requests: Counter[str] = Counter()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    server: FakeHttpServer
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real apis
+
+    def send_json(self, data, headers: dict[str, str] | None = None):
+        body = json.dumps(data).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SpotifyHandler(FakeHandler):
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        self.server.requests[path] += 1
+
+        if path != "/v1/me/player":
+            self.send_empty(404)
+            return
+
+        playback: Playback = self.server.playback
+        self.send_json(
+            {
+                "is_playing": True,
+                "progress_ms": playback.progress_ms,
+                "item": {
+                    "name": playback.name,
+                    "artists": [{"name": playback.artist}],
+                    "album": {"name": playback.album, "images": []},
+                    "external_urls": {"spotify": "https://open.spotify.com/"},
+                    "duration_ms": TRACK_DURATION_MS,
+                },
+            }
+        )
+
+
+class LastFmHandler(FakeHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        method = parse_qs(url.query).get("method", [""])[0]
+        self.server.requests[method] += 1
+
+        playback: Playback = self.server.playback
+
+        if method == "user.getrecenttracks":
+            etag = f'"{playback.number}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_empty(304)
+                return
+
+            track = {
+                "name": playback.name,
+                "artist": {"#text": playback.artist},
+                "album": {"#text": playback.album},
+                "url": "https://www.last.fm/",
+                "image": [],
+                "@attr": {"nowplaying": "true"},
+            }
+            self.send_json({"recenttracks": {"track": [track]}}, {"ETag": etag})
+        elif method == "track.getInfo":
+            self.send_json({"track": {"duration": str(TRACK_DURATION_MS)}})
+        elif method == "album.getInfo":
+            image = {"#text": "https://lastfm.freetls.fastly.net/bench.png"}
+            self.send_json({"album": {"image": [image]}})
+        else:
+            self.send_empty(404)
+
+
+class FakePlex:
+    """
+    Enough of a Plex server for the source: the XML endpoints it reads and the
+    notification websocket, all on one port like the real thing.
+    """
+
+    def __init__(self, port: int, playback: Playback):
+        self.port = port
+        self.playback = playback
+        self.requests: Counter[str] = Counter()
+        self.listeners: set[ServerConnection] = set()
+
+    async def start(self):
+        await serve(
+            self.handle_listener,
+            "127.0.0.1",
+            self.port,
+            process_request=self.process_request,
+        )
+
+    @property
+    def rating_key(self) -> int:
+        return PLEX_TRACK_KEY_OFFSET + self.playback.number
+
+    def get_track_xml(self, rating_key: int, session=False) -> str:
+        number = rating_key - PLEX_TRACK_KEY_OFFSET
+        attributes = {
+            "ratingKey": rating_key,
+            "key": f"/library/metadata/{rating_key}",
+            "type": "track",
+            "title": f"{self.playback.service} track {number}",
+            "grandparentRatingKey": 1,
+            "grandparentTitle": self.playback.artist,
+            "parentRatingKey": 2,
+            "parentTitle": self.playback.album,
+            "duration": TRACK_DURATION_MS,
+            "librarySectionID": 1,
+            "librarySectionTitle": PLEX_LIBRARY,
+        }
+
+        children = ""
+        if session:
+            attributes |= {"viewOffset": self.playback.progress_ms, "sessionKey": 1}
+            children = '<Player state="playing"/><User id="1" title="bench"/>'
+
+        attrs = " ".join(
+            f"{key}={quoteattr(str(value))}" for key, value in attributes.items()
+        )
+        return f"<Track {attrs}>{children}</Track>"
+
+    def get_xml(self, path: str) -> str | None:
+        if path == "/":
+            return '<MediaContainer machineIdentifier="bench" version="1.40.0.0" friendlyName="bench"/>'
+
+        if path == "/library":
+            return '<MediaContainer size="0" title1="Plex Library"/>'
+
+        if path == "/library/sections":
+            return (
+                '<MediaContainer size="1">'
+                f'<Directory key="1" type="artist" title="{PLEX_LIBRARY}" uuid="bench"/>'
+                "</MediaContainer>"
+            )
+
+        if path == "/status/sessions":
+            track = self.get_track_xml(self.rating_key, session=True)
+            return f'<MediaContainer size="1">{track}</MediaContainer>'
+
+        if path.startswith("/library/metadata/"):
+            keys = [int(key) for key in path.rsplit("/", 1)[1].split(",")]
+            tracks = "".join(
+                self.get_track_xml(key) for key in keys if key >= PLEX_TRACK_KEY_OFFSET
+            )
+            return f'<MediaContainer size="{len(keys)}">{tracks}</MediaContainer>'
+
+        return None
+
+    async def process_request(self, connection: ServerConnection, request: Request):
+        path = urlsplit(request.path).path
+        if path == PLEX_NOTIFICATIONS_PATH:
+            self.requests["notifications"] += 1
+            return None  # carry on with the websocket handshake
+
+        if path.startswith("/library/metadata/"):
+            self.requests["/library/metadata"] += 1
+        else:
+            self.requests[path] += 1
+
+        body = self.get_xml(path)
+        if body is None:
+            return connection.respond(404, "")
+
+        response = connection.respond(200, body)
+        del response.headers["Content-Type"]
+        response.headers["Content-Type"] = "text/xml"
+        return response
+
+    async def handle_listener(self, connection: ServerConnection):
+        self.listeners.add(connection)
+        try:
+            await connection.wait_closed()
+        finally:
+            self.listeners.discard(connection)
+
+    def notify(self):
+        """
+        Tell listeners the session moved on to the current track.
+        """
+        notification = {
+            "sessionKey": "1",
+            "ratingKey": str(self.rating_key),
+            "state": "playing",
+            "viewOffset": self.playback.progress_ms,
+        }
+        message = {
+            "NotificationContainer": {
+                "type": "playing",
+                "size": 1,
+                "PlaySessionStateNotification": [notification],
+            }
+        }
+        broadcast(self.listeners, json.dumps(message))
@@ -0,0 +1,121 @@
+import asyncio
+import dataclasses
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from pathlib import Path
+
+from .discord_ipc import FakeDiscord
+from .tabs import Tab
+from .upstreams import (
+    FakeHttpServer,
+    FakePlex,
+    LastFmHandler,
+    Playback,
+    SpotifyHandler,
+)
+
+
+@dataclass
+class WorldConfig:
+    runtime_dir: Path
+    spotify_port: int
+    lastfm_port: int
+    plex_port: int
+    api_url: str
+    tabs: int
+    tab_version: int
+    mpris: bool = False  # needs a session bus
+
+
+class World:
+    """
+    Everything the app talks to. Runs in its own process so its cpu time doesn't
+    count against the app's, and takes commands from the benchmark over a pipe.
+    """
+
+    def __init__(self, config: WorldConfig, conn: Connection):
+        self.config = config
+        self.conn = conn
+
+        self.playbacks = {
+            service: Playback(service)
+            for service in ("Spotify", "Last.fm", "Plex", "YouTube", "MPRIS")
+        }
+
+        self.spotify = FakeHttpServer(
+            config.spotify_port, SpotifyHandler, self.playbacks["Spotify"]
+        )
+        self.lastfm = FakeHttpServer(
+            config.lastfm_port, LastFmHandler, self.playbacks["Last.fm"]
+        )
+        self.plex = FakePlex(config.plex_port, self.playbacks["Plex"])
+        self.discord = FakeDiscord(config.runtime_dir)
+        self.mpris = None
+
+        if config.mpris:
+            # only imported when asked for, it's linux only
+            from .mpris import FakeMprisPlayer
+
+            self.mpris = FakeMprisPlayer(self.playbacks["MPRIS"])
+
+        # every tab plays the same video, the worst case for fan-in
+        self.tabs = [
+            Tab(config.api_url, self.playbacks["YouTube"], config.tab_version)
+            for _ in range(config.tabs)
+        ]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        self.spotify.start()
+        self.lastfm.start()
+        await self.plex.start()
+        await self.discord.start()
+
+        for tab in self.tabs:
+            loop.create_task(tab.run())
+
+        if self.mpris:
+            loop.create_task(self.mpris.run())
+            await self.mpris.ready.wait()
+
+        self.conn.send("ready")
+
+        while True:
+            command, *args = await asyncio.to_thread(self.conn.recv)
+
+            match command:
+                case "change":
+                    self.conn.send(await self.change(*args))
+                case "report":
+                    self.conn.send(self.get_report())
+                case "stop":
+                    await asyncio.gather(*(tab.close() for tab in self.tabs))
+                    return
+
+    async def change(self, service: str) -> tuple[str, float]:
+        name, changed_at = self.playbacks[service].change()
+
+        if service == "Plex":
+            self.plex.notify()
+        elif service == "MPRIS" and self.mpris:
+            await self.mpris.notify()
+
+        return name, changed_at
+
+    def get_report(self) -> dict:
+        return {
+            "requests": {
+                "Spotify": dict(self.spotify.requests),
+                "Last.fm": dict(self.lastfm.requests),
+                "Plex": dict(self.plex.requests),
+                "YouTube": {"track_update": sum(tab.sent for tab in self.tabs)},
+                "MPRIS": dict(self.mpris.requests) if self.mpris else {},
+            },
+            "frames": [dataclasses.astuple(frame) for frame in self.discord.frames],
+            "handshakes": self.discord.handshakes,
+        }
+
+
+def run_world(config: WorldConfig, conn: Connection):
+    asyncio.run(World(config, conn).run())
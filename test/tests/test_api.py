@@ -0,0 +1,136 @@
+from typing import cast
+
+import pytest
+from websockets.asyncio.server import ServerConnection
+
+from discord_music_rpc import api
+from discord_music_rpc.api import Api, Client
+from discord_music_rpc.config import Config, SpotifyAccountConfig, SpotifyConfig
+from discord_music_rpc.tracks import TrackRegistry
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = TrackRegistry()
+    monkeypatch.setattr(api, "track_registry", registry)
+    return registry
+
+
+@pytest.fixture
+def config():
+    return Config(
+        spotify=SpotifyConfig(
+            enabled=True, accounts=[SpotifyAccountConfig(name="living-room")]
+        )
+    )
+
+
+def make_client():
+    # handle_batch only uses the connection to tell producers apart
+    return Client(conn=cast(ServerConnection, object()))
+
+
+def make_update(seq, name="Song", account="living-room", source="Spotify"):
+    return {
+        "source": source,
+        "account": account,
+        "seq": seq,
+        "source_image": "logo",
+        "data": {"name": name, "artist": "Artist"},
+    }
+
+
+def get_names(registry):
+    return {key: track.track.name for key, track in registry.get_tracks()[1].items()}
+
+
+def test_batch_skips_stale_and_repeated_updates(registry, config):
+    server = Api(tracker=None)
+    client = make_client()
+
+    server.handle_batch(client, [make_update(2, "Two")], config)
+    server.handle_batch(
+        client, [make_update(1, "One"), make_update(2, "Again")], config
+    )
+
+    assert get_names(registry) == {("Spotify", "living-room"): "Two"}
+
+    server.handle_batch(client, [make_update(3, "Three")], config)
+    assert get_names(registry) == {("Spotify", "living-room"): "Three"}
+
+
+def test_batch_sequences_are_per_source_and_account(registry, config):
+    server = Api(tracker=None)
+    client = make_client()
+
+    server.handle_batch(
+        client,
+        [make_update(5, "Account"), make_update(1, "Main", account=None)],
+        config,
+    )
+
+    assert get_names(registry) == {
+        ("Spotify", "living-room"): "Account",
+        ("Spotify", None): "Main",
+    }
+
+
+def test_batch_sequences_are_per_connection(registry, config):
+    server = Api(tracker=None)
+    first, second = make_client(), make_client()
+
+    server.handle_batch(first, [make_update(5, "First")], config)
+    server.handle_batch(second, [make_update(1, "Second")], config)
+
+    # both count, the first reporter keeps the key until it goes away
+    assert get_names(registry) == {("Spotify", "living-room"): "First"}
+    assert set(second.producers) == {(second.conn, ("Spotify", "living-room"))}
+
+
+def test_batch_doesnt_make_up_accounts(registry, config):
+    server = Api(tracker=None)
+    client = make_client()
+
+    server.handle_batch(
+        client,
+        [make_update(1, account=f"made-up-{i}") for i in range(10)]
+        + [make_update(1, source="Nope")],
+        config,
+    )
+
+    assert set(get_names(registry)) == {("Spotify", None)}
+
+
+def test_batch_sequences_are_per_reported_account(registry, config):
+    server = Api(tracker=None)
+    client = make_client()
+
+    server.handle_batch(client, [make_update(10, "Kitchen", account="kitchen")], config)
+    server.handle_batch(
+        client,
+        [
+            make_update(1, "Office", account="office"),
+            make_update(2, "Office Again", account="office"),
+        ],
+        config,
+    )
+
+    # both show as the source itself, but neither's sequence blocks the other
+    assert client.sequences == {("Spotify", "kitchen"): 10, ("Spotify", "office"): 2}
+    assert get_names(registry) == {("Spotify", None): "Kitchen"}
+
+    # and one clearing its track doesn't clear the other's
+    server.handle_batch(
+        client, [{**make_update(11, account="kitchen"), "data": None}], config
+    )
+    assert get_names(registry) == {("Spotify", None): "Office Again"}
+
+
+def test_batch_clears_a_track_with_no_data(registry, config):
+    server = Api(tracker=None)
+    client = make_client()
+
+    server.handle_batch(client, [make_update(1)], config)
+    server.handle_batch(client, [{**make_update(2), "data": None}], config)
+
+    assert get_names(registry) == {}
@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import pytest
+
+from discord_music_rpc.config import Config, ConfigWatcher, SpotifyConfig
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    written: list[Path] = []
+    write_bytes = Path.write_bytes
+
+    def record(path, data):
+        written.append(path)
+        return write_bytes(path, data)
+
+    monkeypatch.setattr(Path, "write_bytes", record)
+    return written
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    parsed: list[str] = []
+    from_yaml = Config.from_yaml
+
+    def record(text):
+        parsed.append(text)
+        return from_yaml(text)
+
+    monkeypatch.setattr(Config, "from_yaml", staticmethod(record))
+    return parsed
+
+
+def test_normalised_config_isnt_rewritten(tmp_path, writes, parses):
+    path = tmp_path / "config.yaml"
+    path.write_text(Config().to_yaml())
+    writes.clear()
+
+    watcher = ConfigWatcher(path)
+    config = watcher.load()
+
+    assert writes == []
+    assert len(parses) == 1
+
+    # nothing changed, so nothing is read again
+    assert watcher.load() is config
+    assert len(parses) == 1
+
+
+def test_unchanged_content_isnt_parsed_again(tmp_path, writes, parses):
+    path = tmp_path / "config.yaml"
+    path.write_text(Config().to_yaml())
+
+    watcher = ConfigWatcher(path)
+    config = watcher.load()
+
+    # e.g. the file was touched or saved without changes
+    watcher.on_change()
+    assert watcher.load() is config
+    assert len(parses) == 1
+
+
+def test_missing_settings_are_saved_back_once(tmp_path, writes, parses):
+    path = tmp_path / "config.yaml"
+    path.write_text("spotify:\n  enabled: true\n")
+
+    watcher = ConfigWatcher(path)
+    config = watcher.load()
+
+    assert config.spotify.enabled
+    assert writes == [path]
+    assert path.read_text() == config.to_yaml()
+
+    # our own write shows up as a change, it shouldn't cause another one
+    watcher.on_change()
+    assert watcher.load() is config
+    assert writes == [path]
+    assert len(parses) == 1
+
+
+def test_changed_content_is_reloaded(tmp_path):
+    path = tmp_path / "config.yaml"
+    path.write_text(Config().to_yaml())
+
+    watcher = ConfigWatcher(path)
+    assert not watcher.load().spotify.enabled
+
+    path.write_text(Config(spotify=SpotifyConfig(enabled=True)).to_yaml())
+    watcher.on_change()
+    assert watcher.load().spotify.enabled
+
+
+def test_invalid_config_keeps_the_previous_one(tmp_path, writes):
+    path = tmp_path / "config.yaml"
+    path.write_text(Config().to_yaml())
+
+    watcher = ConfigWatcher(path)
+    config = watcher.load()
+
+    path.write_text("api:\n  port: not a port\n")
+    writes.clear()
+    watcher.on_change()
+
+    assert watcher.load() is config
+    assert writes == []  # the user's broken file is left alone
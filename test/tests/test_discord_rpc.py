@@ -0,0 +1,31 @@
+from discord_music_rpc.discord_rpc import PROGRESS_TOLERANCE_MS, is_same_activity
+
+
+def test_is_same_activity():
+    activity = {"details": "Song", "state": "Artist", "start": 1000, "end": 181000}
+
+    assert is_same_activity(activity, dict(activity))
+    assert not is_same_activity(activity, {**activity, "details": "Other"})
+    assert not is_same_activity(activity, {**activity, "buttons": []})
+
+
+def test_is_same_activity_tolerates_small_timestamp_drift():
+    activity = {"details": "Song", "start": 1000, "end": 181000}
+    drifted = {"details": "Song", "start": 1500, "end": 181500}
+    seeked = {
+        "details": "Song",
+        "start": 1000 + PROGRESS_TOLERANCE_MS + 1,
+        "end": 181000,
+    }
+
+    assert is_same_activity(activity, drifted)
+    assert not is_same_activity(activity, seeked)
+
+
+def test_is_same_activity_with_nothing_showing():
+    assert is_same_activity(None, None)
+    assert not is_same_activity(None, {"details": "Song"})
+    assert not is_same_activity({"details": "Song"}, None)
+
+    # losing progress isn't drift
+    assert not is_same_activity({"start": 1000}, {"start": None})
@@ -0,0 +1,76 @@
+from discord_music_rpc.sources import (
+    BOUNDARY_OVERRUN_SEC,
+    BOUNDARY_WINDOW_SEC,
+    SEEK_TOLERANCE_MS,
+    Track,
+    get_adaptive_gap,
+    has_track_changed,
+)
+
+
+def test_adaptive_gap_is_slow_mid_track():
+    assert get_adaptive_gap(1, 10, 120, 0) == 10
+
+    # but wakes up in time for the end of the track
+    assert get_adaptive_gap(1, 10, BOUNDARY_WINDOW_SEC + 3, 0) == 3
+
+
+def test_adaptive_gap_is_fast_around_the_end_of_a_track():
+    assert get_adaptive_gap(1, 10, BOUNDARY_WINDOW_SEC, 0) == 1
+    assert get_adaptive_gap(1, 10, 0, 0) == 1
+    assert get_adaptive_gap(1, 10, -BOUNDARY_OVERRUN_SEC + 1, 0) == 1
+
+
+def test_adaptive_gap_slows_down_long_past_the_end():
+    # probably paused
+    assert get_adaptive_gap(1, 10, -BOUNDARY_OVERRUN_SEC - 1, 0) == 10
+
+
+def test_adaptive_gap_backs_off_without_a_duration():
+    assert [get_adaptive_gap(1, 10, None, polls) for polls in range(6)] == [
+        1,
+        2,
+        4,
+        8,
+        10,
+        10,
+    ]
+
+
+def test_adaptive_gap_never_polls_faster_than_normal():
+    assert get_adaptive_gap(5, 2, 120, 0) == 5
+    assert get_adaptive_gap(5, 2, None, 3) == 5
+
+
+def test_progress_is_extrapolated_from_when_it_was_sampled():
+    track = Track(
+        "Song", "Artist", progress_ms=1000, duration_ms=10000, progress_time=100
+    )
+
+    assert track.get_progress_ms(now=102) == 3000
+    assert track.get_remaining_sec(now=102) == 7
+
+
+def test_progress_without_a_sample_time_isnt_extrapolated():
+    assert Track("Song", "Artist", progress_ms=1000).get_progress_ms(now=102) == 1000
+    assert Track("Song", "Artist", progress_ms=1000).get_remaining_sec() is None
+
+
+def test_progress_moving_with_the_clock_isnt_a_change():
+    old = Track("Song", "Artist", progress_ms=1000, progress_time=100)
+
+    assert not has_track_changed(
+        old, Track("Song", "Artist", progress_ms=31000, progress_time=130)
+    )
+    assert has_track_changed(
+        old,
+        Track(
+            "Song",
+            "Artist",
+            progress_ms=31000 + SEEK_TOLERANCE_MS + 1,
+            progress_time=130,
+        ),
+    )
+    assert has_track_changed(
+        old, Track("Other", "Artist", progress_ms=1000, progress_time=100)
+    )
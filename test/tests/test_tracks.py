@@ -0,0 +1,154 @@
+from discord_music_rpc.sources import SourceKey, Track, TrackWithSource
+from discord_music_rpc.tracks import (
+    TrackRegistry,
+    arbitrate,
+    is_same_song,
+    normalize_artists,
+    normalize_title,
+)
+
+
+def make_track(name="Song", artist="Artist", source="Spotify", account=None, **kwargs):
+    return TrackWithSource(Track(name, artist, **kwargs), source, "logo", account)
+
+
+def test_first_producer_wins_until_it_goes_away():
+    registry = TrackRegistry()
+
+    registry.put("first", make_track("One"))
+    registry.put("second", make_track("Two"))
+    assert registry.get_tracks()[1][("Spotify", None)].track.name == "One"
+
+    registry.put("first", None)
+    assert registry.get_tracks()[1][("Spotify", None)].track.name == "Two"
+
+    registry.put("second", None)
+    assert registry.get_tracks()[1] == {}
+
+
+def test_replacing_a_track_keeps_the_producers_place():
+    registry = TrackRegistry()
+
+    registry.put("first", make_track("One"))
+    registry.put("second", make_track("Two"))
+    registry.put("first", make_track("Three"))
+
+    assert registry.get_tracks()[1][("Spotify", None)].track.name == "Three"
+
+
+def test_version_only_moves_when_the_track_changes():
+    registry = TrackRegistry()
+
+    registry.put("source", make_track(progress_ms=1000, progress_time=100))
+    version = registry.version
+
+    # progress moving along with the clock is the same track
+    registry.put("source", make_track(progress_ms=3000, progress_time=102))
+    assert registry.version == version
+
+    # a seek isn't
+    registry.put("source", make_track(progress_ms=60000, progress_time=103))
+    assert registry.version == version + 1
+
+    registry.put("source", make_track("Other"))
+    assert registry.version == version + 2
+
+
+def test_expired_tracks_are_dropped():
+    registry = TrackRegistry()
+
+    registry.put("stale", make_track("One"), ttl_sec=-1)
+    registry.put("fresh", make_track("Two", source="Plex"), ttl_sec=60)
+    registry.put("forever", make_track("Three", source="Last.fm"))
+    version = registry.version
+
+    registry.expire()
+
+    assert set(registry.get_tracks()[1]) == {("Plex", None), ("Last.fm", None)}
+    assert registry.version == version + 1
+
+
+def test_expiry_falls_back_to_the_next_producer():
+    registry = TrackRegistry()
+
+    registry.put("first", make_track("One"), ttl_sec=-1)
+    registry.put("second", make_track("Two"))
+    registry.expire()
+
+    assert registry.get_tracks()[1][("Spotify", None)].track.name == "Two"
+
+
+def test_next_deadline_is_the_earliest_expiry():
+    registry = TrackRegistry()
+
+    registry.put("soon", make_track(source="Spotify"), ttl_sec=10)
+    registry.put("later", make_track(source="Plex"), ttl_sec=100)
+
+    entry = registry.entries[("Spotify", None)]["soon"]
+    assert registry.get_next_deadline() == entry.expires
+
+
+def test_touch_pushes_expiry_back():
+    registry = TrackRegistry()
+
+    registry.put("producer", make_track(), ttl_sec=-1)
+    registry.touch("producer", 60)
+    registry.expire()
+
+    assert ("Spotify", None) in registry.get_tracks()[1]
+
+
+def test_touch_leaves_tracks_without_expiry_alone():
+    registry = TrackRegistry()
+
+    registry.put("producer", make_track())
+    registry.touch("producer", 60)
+    registry.touch("unknown", 60)
+
+    assert registry.get_next_deadline() is None
+
+
+def test_normalize_title():
+    assert normalize_title("Song (feat. Someone)") == "song"
+    assert normalize_title("Song - 2011 Remaster") == "song"
+    assert normalize_title("Song [Remastered]") == "song"
+    assert normalize_title("Song ft. Someone") == "song"
+    assert normalize_title("(untitled)") == "untitled"
+
+
+def test_normalize_artists():
+    assert normalize_artists("A, B & C") == {"a", "b", "c"}
+    assert normalize_artists("A feat. B") == {"a", "b"}
+    assert normalize_artists("A x B") == {"a", "b"}
+    assert normalize_artists("Band (Official)") == {"band"}
+
+
+def test_is_same_song():
+    spotify = Track("Song - Radio Edit", "Artist, Guest", duration_ms=200000)
+    lastfm = Track("Song", "Artist", duration_ms=201000)
+    assert is_same_song(spotify, lastfm)
+
+    assert not is_same_song(spotify, Track("Song", "Someone Else"))
+    assert not is_same_song(spotify, Track("Song", "Artist", duration_ms=300000))
+
+    # durations are only compared when both have one
+    assert is_same_song(spotify, Track("Song", "Artist"))
+
+
+def test_arbitrate_keeps_the_highest_priority_source():
+    tracks: dict[SourceKey, TrackWithSource] = {
+        ("Last.fm", None): make_track("Song", source="Last.fm"),
+        ("Spotify", None): make_track("Song (feat. X)", source="Spotify"),
+        ("Plex", None): make_track("Something Else", source="Plex"),
+    }
+
+    assert set(arbitrate(tracks)) == {("Spotify", None), ("Plex", None)}
+
+
+def test_arbitrate_keeps_the_same_song_on_different_accounts():
+    tracks: dict[SourceKey, TrackWithSource] = {
+        ("Spotify", "a"): make_track(account="a"),
+        ("Last.fm", "b"): make_track(source="Last.fm", account="b"),
+    }
+
+    assert set(arbitrate(tracks)) == set(tracks)
@@ -0,0 +1,40 @@
+import pytest
+
+from discord_music_rpc import utils
+from discord_music_rpc.utils import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rate_limiter_allows_a_burst_then_waits_for_the_window(clock):
+    limiter = RateLimiter(5, 20)
+
+    assert limiter.try_acquire()
+    clock[0] += 4
+    assert all(limiter.try_acquire() for _ in range(4))
+    assert not limiter.try_acquire()
+    assert limiter.time_until_available() == pytest.approx(16)
+
+    # only the first one has left the window
+    clock[0] += 16
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.time_until_available() == pytest.approx(4)
+
+
+def test_rate_limiter_never_allows_more_than_the_limit_in_a_window(clock):
+    limiter = RateLimiter(5, 20)
+    allowed = []
+
+    for _ in range(200):
+        if limiter.try_acquire():
+            allowed.append(clock[0])
+        clock[0] += 0.5
+
+    assert len(allowed) == 25
+    assert all(later - earlier >= 20 for earlier, later in zip(allowed, allowed[5:]))